@@ -1,108 +1,220 @@
 import os
-import time
 import json
 import argparse
 import textwrap
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
-import pandas as pd
 from tabulate import tabulate
 from trulens.providers.openai import OpenAI
 
 from src.utils.connect_db import connect_to_db
 from src.setup.pgvector_extentsion import enable_pgvector_extension
 from src.setup.create_table import create_track_table
+from src.setup.create_index import create_vector_indexes, find_vector_index, index_name, INDEX_TYPES
+from src.setup.tune_index import tune_search_params
 from src.evaluation.similarity.print_similarity import print_similarity
 from src.setup.data_to_pgvector import insert_into_pgvector
-from src.evaluation.trulens.evaluation import evaluate_trulens
-from src.evaluation.similarity.metrics import similarity
-from src.data.meta_results import generate_meta_results
+from src.evaluation.trulens.evaluation import evaluate_trulens, GROUNDEDNESS_MODES
+from src.evaluation.trulens.provider import CachedProvider, ScheduledProvider
+from src.utils.knn_vote import KNN_MODELS
+from src.utils.llm_client import GROQ_MODELS, OPENAI_MODELS
+from src.utils.rate_limit import RateLimitScheduler, parse_rate_limits
+from src.evaluation.similarity.metrics import similarity, similarity_many
+from src.data.meta_results import MetaResultsAggregator, meta_results_from_file
+from src.data.results_writer import RESULTS_FILE, ResultsWriter, write_overall_results
+from src.utils.feature_store import load_feature_store
+from src.utils.formatting import VECTOR_COLUMNS
+from src.utils.numpy_retrieval import BACKENDS
+from src.utils.retrieval import SEARCH_METRICS, normalize_metric
+from src.utils.concurrency import StageLimits
+from src.utils.cache import CACHE_MODES, DiskCache
+from src.utils.context import CONTEXT_MODES
 from src.rag import RAG
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def setup():
+# Persistenter Cache für die Antworten der Generierungsmodelle
+COMPLETION_CACHE_FILE = "src/data/cache/completions.sqlite"
+# Persistenter Cache für die Ergebnisse der TruLens-Feedback-Funktionen
+FEEDBACK_CACHE_FILE = "src/data/cache/feedback.sqlite"
+
+# Metriken der CLI, 'inner-product' wird intern zu 'inner_product'
+SIMILARITY_SEARCH_CHOICES = [metric.replace("_", "-") for metric in SEARCH_METRICS]
+
+def setup(index_type="hnsw", index_metrics=None, m=16, ef_construction=64, lists=None, workers=1, chunk_size=50_000,
+          incremental=False, reindex_threshold=0.2, tune_indexes=True, tune_top_k=10, target_recall=0.95):
     """
-    Führt das Setup durch: aktiviert die Extension, erstellt die Tabelle und lädt die Daten.
-    Mit Ladebalken für Fortschritt.
+    Führt das Setup durch: aktiviert die Extension, erstellt die Tabelle, lädt die Daten
+    und baut die Vektorindizes. Mit Ladebalken für Fortschritt.
+
+    Ein Index liefert eine approximative Suche. Daher wird der Suchparameter jedes neu gebauten
+    Index direkt auf den Ziel-Recall getunt (siehe tune_search_params), sofern tune_indexes gesetzt ist.
+
+    Mit incremental bleiben Tabelle und Indizes erhalten und nur neue, geänderte und entfernte
+    Tracks werden übernommen. Die Indizes werden nur neu gebaut, wenn mindestens der Anteil
+    reindex_threshold der Zeilen geändert wurde (oder ein Index fehlt).
     """
     conn = connect_to_db()
-    steps = [
-        enable_pgvector_extension,
-        create_track_table,
-        insert_into_pgvector
-    ]
-
-    with tqdm(total=len(steps), desc="Setup-Prozess", unit="Schritt") as pbar:
-        for func in steps:
-            time.sleep(0.1)  # Simuliert eine kleine Verzögerung
-            func(conn)  # Führt die Funktion aus
-            pbar.update(1)  # Aktualisiert den Ladebalken
+
+    with tqdm(total=3, desc="Setup-Prozess", unit="Schritt") as pbar:
+        enable_pgvector_extension(conn)
+        pbar.update(1)
+        create_track_table(conn, incremental=incremental)
+        pbar.update(1)
+        changes = insert_into_pgvector(conn, chunk_size=chunk_size, workers=workers, incremental=incremental)
+        pbar.update(1)
+
+    if index_type != "none":
+        metrics = index_metrics or list(SEARCH_METRICS.keys())
+        if incremental:
+            cursor = conn.cursor()
+            cursor.execute("SELECT count(*) FROM track;")
+            total = cursor.fetchone()[0]
+            cursor.close()
+            changed_fraction = sum(changes.values()) / max(total, 1)
+
+            if changed_fraction < reindex_threshold:
+                # Neue und geänderte Zeilen wurden bereits in die bestehenden Indizes eingetragen
+                metrics = [metric for metric in metrics if find_vector_index(conn, metric) is None]
+                print(f"{changed_fraction:.1%} der Zeilen geändert, Indizes werden nicht neu gebaut.")
+
+        if metrics:
+            durations = create_vector_indexes(conn, index_type=index_type, metrics=metrics, m=m,
+                                              ef_construction=ef_construction, lists=lists)
+            if tune_indexes:
+                built = [metric for metric in metrics if index_name(metric, index_type) in durations]
+                for metric in built:
+                    tune_search_params(conn, metric, top_k=tune_top_k, target_recall=target_recall)
 
     conn.close()
     print("Setup erfolgreich abgeschlossen.")
 
-def evaluation_from_data(data_size, similarity_search_type, top_k, model_name="llama-3.3-70b-versatile", eval_model="gpt-3.5-turbo"):
+def print_retrieval_stats(rag):
+    stats = rag.retrieval_memo.stats()
+    print(f"Retrieval: {stats['misses']} Suchen, {stats['hits']} aus dem Memo beantwortet.")
 
-    data = pd.read_csv("src/data/preprocessed/data.csv")
+def print_cache_stats(name, cache):
+    if cache.mode == "off":
+        return
+    stats = cache.stats()
+    print(f"{name}: {stats['hits']} Treffer, {stats['misses']} Fehlschläge, {stats['entries']} Einträge.")
+
+def tune(similarity_search_type, top_k, target_recall, sample_size):
+    """
+    Tunt den Suchparameter des Index einer Metrik auf den Ziel-Recall und speichert ihn.
+    """
+    conn = connect_to_db()
+    tune_search_params(conn, normalize_metric(similarity_search_type), top_k=top_k, target_recall=target_recall, sample_size=sample_size)
+    conn.close()
+
+def evaluate_track(provider, rag, input_vector, label, similarity_results, groundedness_options):
+    """
+    Evaluiert einen einzelnen Track: Generierung, TruLens-Feedback und Ähnlichkeitsmetriken des Kontexts.
+    """
+    evaluation = evaluate_trulens(provider=provider, input_vector=input_vector, rag=rag, ground_truth=label, **groundedness_options)
+    evaluation["context"] = {}
+    
+    for result in similarity_results:
+        rank = result["Rang"]
+        evaluation["context"][rank] = {
+            "id": result["ID"],
+            "cosine similarity": result["Cosine Similarity"],
+            "euclidean distance": result["Euclidean Distance"],
+            "manhattan distance": result["Manhattan Distance"],
+            "mahalanobis distance": result["Mahalanobis Distance"],
+            "pearson correlation": result["Pearson Correlation"]
+        }
+    return evaluation
+
+def evaluation_from_data(data_size, similarity_search_type, top_k, model_name="llama-3.3-70b-versatile", eval_model="gpt-3.5-turbo", batch_size=256, backend="pgvector",
+                         concurrency=1, db_concurrency=None, generation_concurrency=None, eval_concurrency=None, cache_mode="read-write",
+                         groundedness_mode="per-chunk", max_batch_chars=8000, skip_combined_context=False, rate_limits=None, resume=False,
+                         context_mode="tables", context_tokens=None):
+
+    data = load_feature_store().frame()
     if data_size != "full":
         data = data.sample(int(data_size), random_state=1).reset_index(drop=True)
 
-    vector_columns = [
-        "Danceability", "Energy", "Key", "Loudness", "Mode", "Speechiness",
-        "Acousticness", "Instrumentalness", "Liveness", "Valence", "Tempo", 
-        "Duration_ms", "Time_Signature"
-    ]
-
-    data['Vector'] = data[vector_columns].apply(lambda row: row.tolist(), axis=1)
-
-    ground_truth = []
-    for _, row in data.iterrows():
-        ground_truth.append({
-            "query": row["Vector"], 
-            "expected_response": row["Label"],
-        })
-
-    rag = RAG(model_name=model_name, limit=top_k, metric=similarity_search_type)
-    provider = OpenAI(model_engine=eval_model)
-
-    results = {}
-    with tqdm(total=len(data), desc="Evaluation", unit="Step") as pbar:
-        for index in range(len(data)):
-            sub_df = data.iloc[[index]].reset_index(drop=True)
-            input_vector = sub_df[vector_columns].iloc[0].tolist()
-            
-            record_id = sub_df["ID"].iloc[0]
-            label = sub_df["Label"].iloc[0]
-
-            similar_tracks = rag.retrieve_only(query=input_vector)
-
-            similarity_results = similarity(similar_tracks=similar_tracks, input_vector=input_vector)
-
-            evaluation = evaluate_trulens(provider=provider, input_vector=input_vector, rag=rag, ground_truth=label)
-            evaluation["context"] = {}
-            
-            for result in similarity_results:
-                rank = result["Rang"]
-                evaluation["context"][rank] = {
-                    "id": result["ID"],
-                    "cosine similarity": result["Cosine Similarity"],
-                    "euclidean distance": result["Euclidean Distance"],
-                    "manhattan distance": result["Manhattan Distance"],
-                    "mahalanobis distance": result["Mahalanobis Distance"],
-                    "pearson correlation": result["Pearson Correlation"]
-                }
-
-            # Speichern der Evaluation mit der ID als Schlüssel
-            results[record_id] = evaluation
-            pbar.update(1)
-
-    overall_results = {
-        "meta results": generate_meta_results(results),
-        "results": results
+    # Ergebnisse werden fortlaufend geschrieben, bei --resume werden bereits evaluierte Tracks übersprungen
+    writer = ResultsWriter(RESULTS_FILE, resume=resume)
+    if writer.recorded_ids:
+        data = data[~data["ID"].isin(writer.recorded_ids)].reset_index(drop=True)
+        print(f"{len(writer.recorded_ids)} Tracks bereits evaluiert, {len(data)} verbleibend.")
+
+    vector_columns = VECTOR_COLUMNS
+
+    # Begrenzung der gleichzeitigen Aufrufe je Stufe, standardmäßig so viele wie Tracks parallel laufen
+    limits = StageLimits(
+        db=db_concurrency or concurrency,
+        generation=generation_concurrency or concurrency,
+        evaluation=eval_concurrency or concurrency,
+    )
+    # Gemeinsamer Scheduler für Generierung und Feedback, damit beide Stufen das Rate-Limit einhalten
+    scheduler = RateLimitScheduler(parse_rate_limits(rate_limits), max_concurrency=max(limits.limits.values()))
+    completion_cache = DiskCache(COMPLETION_CACHE_FILE, mode=cache_mode)
+    rag = RAG(model_name=model_name, limit=top_k, metric=similarity_search_type, batch_size=batch_size, backend=backend,
+              pool_max_size=limits.limits["db"], limits=limits, cache=completion_cache, scheduler=scheduler,
+              context_mode=context_mode, context_tokens=context_tokens)
+    feedback_cache = DiskCache(FEEDBACK_CACHE_FILE, mode=cache_mode)
+    # Cache-Treffer belegen kein Rate-Limit, daher wird der Scheduler innerhalb des Caches angewendet
+    provider = None
+    if eval_model != "none":
+        provider = CachedProvider(ScheduledProvider(OpenAI(model_engine=eval_model), scheduler, model=eval_model), feedback_cache, model=eval_model)
+
+    # Similarity Search für alle Tracks gebündelt in wenigen Abfragen ausführen
+    all_input_vectors = data[vector_columns].values.tolist()
+    all_similar_tracks = rag.retrieve_many(all_input_vectors)
+
+    # Ähnlichkeitsmetriken für alle Tracks vektorisiert berechnen
+    all_similarity_results = similarity_many(all_input_vectors, all_similar_tracks)
+
+    record_ids = data["ID"].tolist()
+    labels = data["Label"].tolist()
+    groundedness_options = {
+        "groundedness_mode": groundedness_mode,
+        "max_batch_chars": max_batch_chars,
+        "skip_combined_context": skip_combined_context,
     }
 
+    # Bis zu 'concurrency' Tracks gleichzeitig evaluieren. Die Ergebnisse werden in der Reihenfolge der
+    # Eingabe geschrieben, sobald alle vorherigen Tracks fertig sind, damit results.jsonl und die
+    # Meta-Ergebnisse unabhängig von der Parallelität sind (auch beim Fortsetzen mit --resume)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        futures = {
+            executor.submit(evaluate_track, provider, rag, all_input_vectors[index], labels[index], all_similarity_results[index], groundedness_options): index
+            for index in range(len(data))
+        }
+        # Laufende Meta-Ergebnisse für die Fortschrittsanzeige
+        aggregator = MetaResultsAggregator()
+        completed = {}
+        next_index = 0
+        with tqdm(total=len(data), desc="Evaluation", unit="Step") as pbar:
+            for future in as_completed(futures):
+                completed[futures[future]] = future.result()
+                while next_index in completed:
+                    result = completed.pop(next_index)
+                    writer.write(record_ids[next_index], result)
+                    aggregator.add(result)
+                    next_index += 1
+                pbar.set_postfix(aggregator.postfix())
+                pbar.update(1)
+    finally:
+        # Bei einem Fehler noch nicht gestartete Tracks abbrechen, die Ergebnisse bleiben für --resume erhalten
+        executor.shutdown(wait=True, cancel_futures=True)
+        writer.close()
+
+    print_retrieval_stats(rag)
+    rag.close()
+    print_cache_stats("Completion-Cache", completion_cache)
+    print_cache_stats("Feedback-Cache", feedback_cache)
+    completion_cache.close()
+    feedback_cache.close()
+    for model, stats in scheduler.stats().items():
+        print(f"Rate-Limit {model}: {stats['throttled']} gedrosselte Anfragen, Parallelität zuletzt {stats['concurrency']}.")
+
     directory = "src/data/results"
     if not os.path.exists(directory):
         os.makedirs(directory)
@@ -113,18 +225,27 @@ def evaluation_from_data(data_size, similarity_search_type, top_k, model_name="l
     # Specify the file name
     file_name = "src/data/results/overall_results.json"
 
-    # Save as JSON
-    with open(file_name, "w", encoding="utf-8") as json_file:
-        json.dump(overall_results, json_file, indent=4)
+    # Aus den geschriebenen Ergebnissen zusammensetzen, ohne sie vollständig zu laden
+    meta_results = meta_results_from_file(RESULTS_FILE)
+    write_overall_results(meta_results, file_name, RESULTS_FILE)
+
+    prompt_tokens = meta_results["distributions"]["prompt_tokens"]
+    if prompt_tokens["count"]:
+        print(f"Prompt-Tokens: Ø {prompt_tokens['mean']:.0f}, p95 {prompt_tokens['p95']:.0f}, max {prompt_tokens['max']:.0f} ({context_mode}).")
 
     print(f"Overall results have been saved to {file_name}.")
 
     
 
-def evaluation_from_user(stage, input, similarity_search_type, top_k, model_name="llama-3.3-70b-versatile", eval_model="gpt-3.5-turbo"):
+def evaluation_from_user(stage, input, similarity_search_type, top_k, model_name="llama-3.3-70b-versatile", eval_model="gpt-3.5-turbo", backend="pgvector", cache_mode="read-write",
+                         groundedness_mode="per-chunk", max_batch_chars=8000, skip_combined_context=False, context_mode="tables", context_tokens=None):
     input_vector = json.loads(input)
 
-    rag = RAG(model_name=model_name, limit=top_k, metric=similarity_search_type)
+    # Eine RAG-Instanz für beide Stufen, die Generierung nutzt die Suche der Retrieval-Stufe aus dem Memo
+    generation = stage == "generation" or stage == "all"
+    completion_cache = DiskCache(COMPLETION_CACHE_FILE, mode=cache_mode) if generation else None
+    rag = RAG(model_name=model_name, limit=top_k, metric=similarity_search_type, backend=backend, cache=completion_cache,
+              context_mode=context_mode, context_tokens=context_tokens)
 
     if stage == "retrieval" or stage == "all":
         # Ähnlichkeitssuche durchführen
@@ -134,19 +255,24 @@ def evaluation_from_user(stage, input, similarity_search_type, top_k, model_name
 
         print_similarity(similar_tracks=similar_tracks, metrics_results=similarity_results)
 
-    if stage == "generation" or stage == "all":
+    if generation:
+        feedback_cache = DiskCache(FEEDBACK_CACHE_FILE, mode=cache_mode)
+        provider = CachedProvider(OpenAI(model_engine=eval_model), feedback_cache, model=eval_model) if eval_model != "none" else None
+
+        evaluation = evaluate_trulens(provider=provider, input_vector=input_vector, rag=rag, ground_truth=None,
+                                      groundedness_mode=groundedness_mode, max_batch_chars=max_batch_chars,
+                                      skip_combined_context=skip_combined_context)
+        # Textwrapping für die langen Begründungen, ohne Evaluierungsmodell gibt es keine Bewertungen
+        def wrap_text(reasons, width=50):
+            return "\n".join(textwrap.wrap(reasons["reason"], width)) if reasons else "-"
 
-        rag = RAG(model_name=model_name, limit=top_k, metric=similarity_search_type)
-        provider = OpenAI(model_engine=eval_model)
-        
-        evaluation = evaluate_trulens(provider=provider, input_vector=input_vector, rag=rag, ground_truth=None)
-        # Textwrapping für die langen Begründungen
-        def wrap_text(text, width=50):
-            return "\n".join(textwrap.wrap(text, width))
+        def score(value):
+            return round(value, 2) if value is not None else "-"
 
         # Tabelle vorbereiten
         headers = [
             "Response",
+            "Prompt Tokens",
             "Groundedness",
             "Relevance Score",
             "Relevance Reason",
@@ -157,11 +283,12 @@ def evaluation_from_user(stage, input, similarity_search_type, top_k, model_name
         rows = [
             [
                 evaluation["response"],
-                round(evaluation["groundedness"], 2),
-                evaluation["relevance"]["score"],
-                wrap_text(evaluation["relevance"]["reasons"]["reason"]),
-                evaluation["context_relevance"]["score"],
-                wrap_text(evaluation["context_relevance"]["reasons"]["reason"]),
+                evaluation["prompt_tokens"],
+                score(evaluation["groundedness"]),
+                score(evaluation["relevance"]["score"]),
+                wrap_text(evaluation["relevance"]["reasons"]),
+                score(evaluation["context_relevance"]["score"]),
+                wrap_text(evaluation["context_relevance"]["reasons"]),
             ]
         ]
 
@@ -169,6 +296,13 @@ def evaluation_from_user(stage, input, similarity_search_type, top_k, model_name
         table = tabulate(rows, headers=headers, tablefmt="grid")
         print(table)
 
+        print_cache_stats("Completion-Cache", completion_cache)
+        print_cache_stats("Feedback-Cache", feedback_cache)
+        completion_cache.close()
+        feedback_cache.close()
+
+    rag.close()
+
 
 def main():
     parser = argparse.ArgumentParser(description="Verwaltungsskript für Datenbankaktionen")
@@ -176,43 +310,108 @@ def main():
 
     # Subparser für 'setup'
     setup_parser = subparsers.add_parser('setup', help="Setup ausführen")
+    setup_parser.add_argument('--index', type=str, default="hnsw", choices=INDEX_TYPES + ["none"],
+                              help="Indextyp für die Similarity Search: 'hnsw', 'ivfflat' oder 'none' (Standard: 'hnsw').")
+    setup_parser.add_argument('--index-metrics', type=str, nargs="+", choices=SIMILARITY_SEARCH_CHOICES,
+                              help="Metriken, für die ein Index erstellt wird (Standard: alle).")
+    setup_parser.add_argument('--m', type=int, default=16,
+                              help="HNSW: maximale Anzahl an Verbindungen pro Knoten (Standard: 16).")
+    setup_parser.add_argument('--ef-construction', type=int, default=64,
+                              help="HNSW: Größe der Kandidatenliste beim Indexaufbau (Standard: 64).")
+    setup_parser.add_argument('--lists', type=int,
+                              help="IVFFlat: Anzahl der Listen (Standard: Zeilen / 1000, ab 1 Mio. Zeilen sqrt(Zeilen)).")
+    setup_parser.add_argument('--workers', type=int, default=1,
+                              help="Anzahl paralleler Verbindungen beim Laden der Daten (Standard: 1).")
+    setup_parser.add_argument('--chunk-size', type=int, default=50_000,
+                              help="Anzahl der Zeilen pro COPY beim Laden der Daten (Standard: 50000).")
+    setup_parser.add_argument('--incremental', action="store_true",
+                              help="Tabelle und Indizes behalten und nur neue, geänderte und entfernte Tracks übernehmen.")
+    setup_parser.add_argument('--reindex-threshold', type=float, default=0.2,
+                              help="Mit --incremental: Anteil geänderter Zeilen, ab dem die Indizes neu gebaut werden (Standard: 0.2).")
+    setup_parser.add_argument('--no-tune', action="store_true",
+                              help="Die Suchparameter neu gebauter Indizes nicht automatisch tunen.")
+    setup_parser.add_argument('--tune-top-k', type=int, default=10,
+                              help="Anzahl der Ergebnisse, für die beim automatischen Tuning der Recall gemessen wird (Standard: 10).")
+    setup_parser.add_argument('--target-recall', type=float, default=0.95,
+                              help="Ziel-Recall@k beim automatischen Tuning (Standard: 0.95).")
+
+    # Subparser für 'tune'
+    tune_parser = subparsers.add_parser('tune', help="Suchparameter des Index auf einen Ziel-Recall tunen")
+    tune_parser.add_argument('--similarity-search', type=str, required=True, choices=SIMILARITY_SEARCH_CHOICES,
+                             help="Metrik, deren Index getunt wird: 'cosine', 'euclidean', 'inner-product', 'manhattan', 'mahalanobis' oder 'pearson'.")
+    tune_parser.add_argument('--top-k', type=int, default=10,
+                             help="Anzahl der Ergebnisse, für die der Recall gemessen wird (Standard: 10).")
+    tune_parser.add_argument('--target-recall', type=float, default=0.95,
+                             help="Ziel-Recall@k zwischen 0 und 1 (Standard: 0.95).")
+    tune_parser.add_argument('--sample-size', type=int, default=100,
+                             help="Anzahl der Anfragevektoren aus dem Datensatz (Standard: 100).")
 
     # Subparser für 'eval-data'
     eval_data_parser = subparsers.add_parser('eval-data', help="Datenevaluation durchführen")
     eval_data_parser.add_argument('--data-size', type=str, required=True,
                                   help="Datengröße, gib entweder eine bestimmte größe an oder 'full' für den ganzen Datensatz.")
-    eval_data_parser.add_argument('--similarity-search', type=str, required=True, choices=['cosine', 'euclidean', 'inner-product'],
-                                  help="Similarity-Search Art: 'cosine', 'euclidean' oder 'inner-product'.")
-    eval_data_parser.add_argument('--top-k', type=str, required=True,
+    eval_data_parser.add_argument('--similarity-search', type=str, required=True, choices=SIMILARITY_SEARCH_CHOICES,
+                                  help="Similarity-Search Art: 'cosine', 'euclidean', 'inner-product', 'manhattan', 'mahalanobis' oder 'pearson'.")
+    eval_data_parser.add_argument('--top-k', type=int, required=True,
                                   help="Die Anzahl der zurückgegebenen Dokumente.")
-    eval_data_parser.add_argument('--model', type=str, required=True, choices=["gpt-4o","gpt-4o-mini","o1","o1-mini","gpt-3.5-turbo",
-                                                                "gemma2-9b-it","llama-3.1-70b-versatile","llama-3.1-8b-instant",
-                                                                "llama-3.2-11b-vision-preview","llama-3.2-1b-preview",
-                                                                "llama-3.2-3b-preview","llama-3.2-90b-vision-preview",
-                                                                "llama-3.3-70b-specdec","llama-3.3-70b-versatile",
-                                                                "llama-guard-3-8b","llama3-70b-8192","llama3-8b-8192",
-                                                                "mixtral-8x7b-32768"],
-                                  help="Modellname. Nur erforderlich für 'all'.")
-    eval_data_parser.add_argument('--eval-model', type=str, required=True, choices=["gpt-4o","gpt-4o-mini","o1","o1-mini","gpt-3.5-turbo"],
-                                  help="Modellname für das Evaluierungsmodell. Nur erforderlich für 'all'.")
+    eval_data_parser.add_argument('--model', type=str, required=True, choices=OPENAI_MODELS + GROQ_MODELS + KNN_MODELS,
+                                  help="Modellname. 'knn-vote' und 'knn-vote-weighted' sagen das Label lokal als Mehrheit der Top-k Tracks voraus.")
+    eval_data_parser.add_argument('--eval-model', type=str, required=True, choices=OPENAI_MODELS + ["none"],
+                                  help="Modellname für das Evaluierungsmodell, 'none' überspringt die TruLens-Feedback-Funktionen.")
+    eval_data_parser.add_argument('--batch-size', type=int, default=256,
+                                  help="Anzahl der Suchvektoren, die gemeinsam in einer SQL-Abfrage gesucht werden (Standard: 256).")
+    eval_data_parser.add_argument('--backend', type=str, default="pgvector", choices=BACKENDS,
+                                  help="Retrieval-Backend: 'pgvector' (Standard), 'numpy' oder 'kdtree' (exakte Suche im Arbeitsspeicher, ohne Datenbank).")
+    eval_data_parser.add_argument('--concurrency', type=int, default=1,
+                                  help="Anzahl der Tracks, die gleichzeitig evaluiert werden (Standard: 1).")
+    eval_data_parser.add_argument('--db-concurrency', type=int,
+                                  help="Maximale Anzahl gleichzeitiger Datenbankabfragen (Standard: --concurrency).")
+    eval_data_parser.add_argument('--generation-concurrency', type=int,
+                                  help="Maximale Anzahl gleichzeitiger Anfragen an das Generierungsmodell (Standard: --concurrency).")
+    eval_data_parser.add_argument('--eval-concurrency', type=int,
+                                  help="Maximale Anzahl gleichzeitiger Anfragen an das Evaluierungsmodell (Standard: --concurrency).")
+    eval_data_parser.add_argument('--groundedness', type=str, default="per-chunk", choices=GROUNDEDNESS_MODES,
+                                  help="Groundedness-Bewertung: 'per-chunk' (eine Anfrage pro Kontext-Abschnitt, Standard) oder 'batched' (alle Abschnitte in einer bzw. wenigen Anfragen).")
+    eval_data_parser.add_argument('--groundedness-max-chars', type=int, default=8000,
+                                  help="Maximale Zeichenanzahl der Kontext-Abschnitte pro gebündelter Groundedness-Anfrage (Standard: 8000).")
+    eval_data_parser.add_argument('--skip-combined-context', action="store_true",
+                                  help="Die zusammengefasste Tabelle am Ende des Kontexts bei der Groundedness überspringen.")
+    eval_data_parser.add_argument('--rate-limit', type=str, nargs="+", metavar="MODELL=ANFRAGEN:TOKENS",
+                                  help="Rate-Limits pro Modell in Anfragen und Tokens pro Minute, z.B. 'llama-3.3-70b-versatile=30:6000'. Ohne Angabe werden die Limits aus den Antwort-Headern übernommen.")
+    eval_data_parser.add_argument('--resume', action="store_true",
+                                  help="Bereits in src/data/results/results.jsonl gespeicherte Tracks überspringen und die Evaluation fortsetzen.")
+    eval_data_parser.add_argument('--context-mode', type=str, default="tables", choices=CONTEXT_MODES,
+                                  help="Kontext für die Generierung: 'tables' (eine Tabelle pro Song und eine Gesamttabelle, Standard) oder 'compact' (eine CSV-Zeile pro Song).")
+    eval_data_parser.add_argument('--context-tokens', type=int,
+                                  help="Mit --context-mode compact: Token-Budget für den Kontext, die am wenigsten ähnlichen Songs werden weggelassen (Standard: unbegrenzt).")
+    eval_data_parser.add_argument('--cache', type=str, default="read-write", choices=CACHE_MODES,
+                                  help="Cache für Antworten des Generierungsmodells und Feedback-Ergebnisse: 'read-write' (Standard), 'read-only' oder 'off'.")
 
     eval_user_parser = subparsers.add_parser('eval-user', help="Benutzerevaluation durchführen")
     eval_user_parser.add_argument('--stage', type=str, required=True, choices=['retrieval', 'generation', 'all'],
                                   help="Evaluationsstufe: 'retrieval', 'generation' oder 'all'.")
-    eval_user_parser.add_argument('--similarity-search', type=str, required=True, choices=['cosine', 'euclidean', 'inner-product'],
-                                  help="Similarity-Search Art: 'cosine', 'euclidean' oder 'inner-product'.")
+    eval_user_parser.add_argument('--similarity-search', type=str, required=True, choices=SIMILARITY_SEARCH_CHOICES,
+                                  help="Similarity-Search Art: 'cosine', 'euclidean', 'inner-product', 'manhattan', 'mahalanobis' oder 'pearson'.")
     eval_user_parser.add_argument('--top-k', type=int, required=True,
                                   help="Die Anzahl der zurückgegebenen Dokumente.")
-    eval_user_parser.add_argument('--model', type=str, choices=["gpt-4o","gpt-4o-mini","o1","o1-mini","gpt-3.5-turbo",
-                                                                "gemma2-9b-it","llama-3.1-70b-versatile","llama-3.1-8b-instant",
-                                                                "llama-3.2-11b-vision-preview","llama-3.2-1b-preview",
-                                                                "llama-3.2-3b-preview","llama-3.2-90b-vision-preview",
-                                                                "llama-3.3-70b-specdec","llama-3.3-70b-versatile",
-                                                                "llama-guard-3-8b","llama3-70b-8192","llama3-8b-8192",
-                                                                "mixtral-8x7b-32768"],
-                                  help="Modellname. Nur erforderlich für 'generation' und 'all'.")
-    eval_user_parser.add_argument('--eval-model', type=str, choices=["gpt-4o","gpt-4o-mini","o1","o1-mini","gpt-3.5-turbo"],
-                                  help="Modellname für das Evaluierungsmodell. Nur erforderlich für 'generation' und 'all'.")
+    eval_user_parser.add_argument('--model', type=str, choices=OPENAI_MODELS + GROQ_MODELS + KNN_MODELS,
+                                  help="Modellname. Nur erforderlich für 'generation' und 'all'. 'knn-vote' und 'knn-vote-weighted' sagen das Label lokal voraus.")
+    eval_user_parser.add_argument('--eval-model', type=str, choices=OPENAI_MODELS + ["none"],
+                                  help="Modellname für das Evaluierungsmodell. Nur erforderlich für 'generation' und 'all', 'none' überspringt die TruLens-Feedback-Funktionen.")
+    eval_user_parser.add_argument('--backend', type=str, default="pgvector", choices=BACKENDS,
+                                  help="Retrieval-Backend: 'pgvector' (Standard), 'numpy' oder 'kdtree' (exakte Suche im Arbeitsspeicher, ohne Datenbank).")
+    eval_user_parser.add_argument('--groundedness', type=str, default="per-chunk", choices=GROUNDEDNESS_MODES,
+                                  help="Groundedness-Bewertung: 'per-chunk' (eine Anfrage pro Kontext-Abschnitt, Standard) oder 'batched' (alle Abschnitte in einer bzw. wenigen Anfragen).")
+    eval_user_parser.add_argument('--groundedness-max-chars', type=int, default=8000,
+                                  help="Maximale Zeichenanzahl der Kontext-Abschnitte pro gebündelter Groundedness-Anfrage (Standard: 8000).")
+    eval_user_parser.add_argument('--skip-combined-context', action="store_true",
+                                  help="Die zusammengefasste Tabelle am Ende des Kontexts bei der Groundedness überspringen.")
+    eval_user_parser.add_argument('--context-mode', type=str, default="tables", choices=CONTEXT_MODES,
+                                  help="Kontext für die Generierung: 'tables' (eine Tabelle pro Song und eine Gesamttabelle, Standard) oder 'compact' (eine CSV-Zeile pro Song).")
+    eval_user_parser.add_argument('--context-tokens', type=int,
+                                  help="Mit --context-mode compact: Token-Budget für den Kontext, die am wenigsten ähnlichen Songs werden weggelassen (Standard: unbegrenzt).")
+    eval_user_parser.add_argument('--cache', type=str, default="read-write", choices=CACHE_MODES,
+                                  help="Cache für Antworten des Generierungsmodells und Feedback-Ergebnisse: 'read-write' (Standard), 'read-only' oder 'off'.")
     eval_user_parser.add_argument('--input', type=str, required=True,
                                   help="Eingaben für die Evaluation. Gebe folgende Werte zwischen 0 und 1 an: [Akustizität, Tanzbarkeit, Dauer, Energie, Instrumentalität, Tonart, Lebendigkeit, Lautstärke, Modus, Sprachanteil, Tempo, Taktart, Valenz].")
 
@@ -221,16 +420,24 @@ def main():
 
     # Aktion basierend auf 'type' ausführen
     if args.type == "setup":
-        setup()
+        index_metrics = [normalize_metric(metric) for metric in args.index_metrics] if args.index_metrics else None
+        setup(args.index, index_metrics, args.m, args.ef_construction, args.lists, args.workers, args.chunk_size,
+              args.incremental, args.reindex_threshold, not args.no_tune, args.tune_top_k, args.target_recall)
+    elif args.type == "tune":
+        tune(args.similarity_search, args.top_k, args.target_recall, args.sample_size)
     elif args.type == "eval-data":
-        evaluation_from_data(args.data_size, args.similarity_search, args.top_k, args.model, args.eval_model)
+        evaluation_from_data(args.data_size, args.similarity_search, args.top_k, args.model, args.eval_model, args.batch_size, args.backend,
+                             args.concurrency, args.db_concurrency, args.generation_concurrency, args.eval_concurrency, args.cache,
+                             args.groundedness, args.groundedness_max_chars, args.skip_combined_context, args.rate_limit, args.resume,
+                             args.context_mode, args.context_tokens)
     elif args.type == "eval-user":
         if args.stage == "retrieval":
-            evaluation_from_user(args.stage, args.input, args.similarity_search, args.top_k)
+            evaluation_from_user(args.stage, args.input, args.similarity_search, args.top_k, backend=args.backend)
         elif args.stage == "generation" or args.stage == "all":
-            evaluation_from_user(args.stage, args.input, args.similarity_search, args.top_k, args.model, args.eval_model)
+            evaluation_from_user(args.stage, args.input, args.similarity_search, args.top_k, args.model, args.eval_model, args.backend, args.cache,
+                                 args.groundedness, args.groundedness_max_chars, args.skip_combined_context, args.context_mode, args.context_tokens)
     else:
-        print(f"Unbekannter Typ: {args.type}. Erlaubte Typen: 'setup', 'eval-user', 'eval-data'.")
+        print(f"Unbekannter Typ: {args.type}. Erlaubte Typen: 'setup', 'tune', 'eval-user', 'eval-data'.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
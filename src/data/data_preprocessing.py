@@ -1,140 +1,119 @@
-import json
-import pandas as pd
-import re
+import os
+import tempfile
 import numpy as np
+import pandas as pd
+
+from src.data.ingest import TrackStore, iter_features, iter_tracks
+from src.utils.feature_store import FeatureStoreWriter
+from src.utils.formatting import VECTOR_COLUMNS
+
+RAW_DIR = "src/data/raw"
+PREPROCESSED_DIR = "src/data/preprocessed"
 
-# Dateien einlesen
-def load_json_file(file_path):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        return json.load(file)
-
-def load_python_dict(file_path):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        content = file.read()
-        # Extrahiere den Dictionary-Teil mit einem Regex
-        match = re.search(r"(yes_ids|no_ids)\s*=\s*(\{.*\})", content, re.DOTALL)
-        if match:
-            return eval(match.group(2))  # Evaluiere nur den Dictionary-Teil
-        else:
-            raise ValueError(f"Keine gültigen Daten in {file_path} gefunden")
-
-# Daten aus Dateien laden
-yes_tracks = load_python_dict('src/data/raw/yes.py')['items']
-no_tracks = load_python_dict('src/data/raw/no.py')['items']
-good_features = load_json_file('src/data/raw/good.json')['audio_features']
-dislike_features = load_json_file('src/data/raw/dislike.json')['audio_features']
-
-# Funktion zur Track-Zuordnung
-def create_track_mapping(tracks, label):
-    return {track['track']['id']: {"name": track['track']['name'], "label": label} for track in tracks}
-
-yes_mapping = create_track_mapping(yes_tracks, "yes")
-no_mapping = create_track_mapping(no_tracks, "no")
-
-def create_feature_mapping(features, label):
-    return {
-        feature['id']: {
-            "danceability": feature.get('danceability'),
-            "energy": feature.get('energy'),
-            "key": feature.get('key'),
-            "loudness": feature.get('loudness'),
-            "mode": feature.get('mode'),
-            "speechiness": feature.get('speechiness'),
-            "acousticness": feature.get('acousticness'),
-            "instrumentalness": feature.get('instrumentalness'),
-            "liveness": feature.get('liveness'),
-            "valence": feature.get('valence'),
-            "tempo": feature.get('tempo'),
-            "duration_ms": feature.get('duration_ms'),
-            "time_signature": feature.get('time_signature'),
-            "label": label,
-        }
-        for feature in features
-    }
-
-good_mapping = create_feature_mapping(good_features, "good")
-dislike_mapping = create_feature_mapping(dislike_features, "dislike")
-
-# Merge aller Daten
-merged_data = {}
-for source in [yes_mapping, no_mapping, good_mapping, dislike_mapping]:
-    for track_id, details in source.items():
-        if track_id not in merged_data:
-            merged_data[track_id] = details
-        else:
-            merged_data[track_id].update(details)
+# Mode ist bereits binär und wird nicht normalisiert
+NORMALIZED_COLUMNS = [column for column in VECTOR_COLUMNS if column != "Mode"]
 
 # Normalisierung der Werte
-features_to_normalize = [
-    "danceability", "energy", "key", "loudness", "speechiness",
-    "acousticness", "instrumentalness", "liveness", "valence", "tempo", "duration_ms", "time_signature"
-]
-
-# Berechnung der Normalisierungsparameter
-normalization_params = {
-    "min": {feature: float('inf') for feature in features_to_normalize},
-    "max": {feature: float('-inf') for feature in features_to_normalize},
-}
-
-# Min- und Max-Werte finden
-for details in merged_data.values():
-    for feature in features_to_normalize:
-        value = details.get(feature)
-        if value is not None:
-            normalization_params["min"][feature] = min(normalization_params["min"][feature], value)
-            normalization_params["max"][feature] = max(normalization_params["max"][feature], value)
-
-# Normalisierung anwenden
-def normalize(value, min_val, max_val):
-    if value is None or min_val == max_val:
-        return value
-    return (value - min_val) / (max_val - min_val)
-
-for details in merged_data.values():
-    for feature in features_to_normalize:
-        details[feature] = normalize(details.get(feature), normalization_params["min"][feature], normalization_params["max"][feature])
+def normalize(df, params):
+    """
+    Min-Max-Skalierung der Merkmale auf [0, 1]. Merkmale ohne Wertebereich bleiben unverändert.
+    """
+    df = df.copy()
+    minimum = pd.Series(params["min"], dtype=float)
+    maximum = pd.Series(params["max"], dtype=float)
+    columns = [column for column in minimum.index if maximum[column] > minimum[column]]
+    df[columns] = (df[columns] - minimum[columns]) / (maximum[columns] - minimum[columns])
+    return df
 
 # Binärcodierung der Labels
-def encode_label(label):
-    return "like" if label == "good" else "dislike"
-
-# Daten in ein DataFrame umwandeln
-data = []
-for track_id, details in merged_data.items():
-    data.append({
-        "ID": track_id,
-        "Name": details.get("name", "Unknown"),
-        "Danceability": details.get("danceability"),
-        "Energy": details.get("energy"),
-        "Key": details.get("key"),
-        "Loudness": details.get("loudness"),
-        "Mode": details.get("mode"),
-        "Speechiness": details.get("speechiness"),
-        "Acousticness": details.get("acousticness"),
-        "Instrumentalness": details.get("instrumentalness"),
-        "Liveness": details.get("liveness"),
-        "Valence": details.get("valence"),
-        "Tempo": details.get("tempo"),
-        "Duration_ms": details.get("duration_ms"),
-        "Time_Signature": details.get("time_signature"),
-        "Label": encode_label(details.get("label")),
-    })
-
-# DataFrame erstellen und speichern
-df = pd.DataFrame(data)
-csv_file = 'src/data/preprocessed/data.csv'
-df.to_csv(csv_file, index=False, encoding='utf-8')
-
-print(f"Die Daten wurden erfolgreich in {csv_file} gespeichert.")
-
-# Kovarianzmatrix berechnen
-features = df[[
-    "Danceability", "Energy", "Key", "Loudness", "Mode", "Speechiness",
-    "Acousticness", "Instrumentalness", "Liveness", "Valence", "Tempo", "Duration_ms", "Time_Signature"
-]]
-cov_matrix = features.cov()
-
-# Kovarianzmatrix speichern
-cov_file = 'src/data/preprocessed/covariance_matrix.csv'
-cov_matrix.to_csv(cov_file, index=True)
-print(f"Kovarianzmatrix wurde in {cov_file} gespeichert.")
+def encode_labels(df):
+    df = df.copy()
+    df["Label"] = df["Label"].eq("good").map({True: "like", False: "dislike"})
+    return df
+
+class CovarianceAccumulator:
+    """
+    Berechnet die Kovarianzmatrix blockweise wie DataFrame.cov(): fehlende Werte werden
+    paarweise ausgelassen. Gespeichert werden nur Summen der Größe (Merkmale x Merkmale).
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        size = len(columns)
+        self._count = np.zeros((size, size))
+        self._sums = np.zeros((size, size))
+        self._products = np.zeros((size, size))
+        self._shift = None
+
+    def add(self, df):
+        values = df[self.columns].to_numpy(dtype=np.float64)
+        present = ~np.isnan(values)
+        if self._shift is None:
+            # Verschiebung um die Mittelwerte des ersten Blocks verringert Auslöschung in den Summen
+            counts = present.sum(axis=0)
+            self._shift = np.where(counts > 0, np.nansum(values, axis=0) / np.maximum(counts, 1), 0.0)
+        values = np.where(present, values - self._shift, 0.0)
+        mask = present.astype(np.float64)
+        self._count += mask.T @ mask
+        # _sums[i, j]: Summe von Merkmal i über die Zeilen, in denen i und j vorhanden sind
+        self._sums += values.T @ mask
+        self._products += values.T @ values
+
+    def result(self):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            covariance = (self._products - self._sums * self._sums.T / self._count) / (self._count - 1)
+        covariance[self._count < 2] = np.nan
+        return pd.DataFrame(covariance, index=self.columns, columns=self.columns)
+
+def run_pipeline(raw_dir=RAW_DIR, output_dir=PREPROCESSED_DIR, chunk_size=100_000):
+    """
+    Führt die Vorverarbeitung mit begrenztem Speicherbedarf aus: Quellen werden als Datensätze
+    gestreamt und in einer SQLite-Datei über die ID zusammengeführt, danach blockweise normalisiert,
+    in data.csv und den Feature Store (feature_store/) geschrieben und in die Kovarianzmatrix eingerechnet.
+    Spätere Quellen überschreiben die Werte früherer, die Reihenfolge entspricht dem ersten Auftreten eines Tracks.
+
+    :param raw_dir: Verzeichnis mit yes.py, no.py, good.json und dislike.json.
+    :param output_dir: Verzeichnis für data.csv, covariance_matrix.csv und feature_store/.
+    :param chunk_size: Anzahl der Tracks pro Block.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    csv_file = os.path.join(output_dir, "data.csv")
+    cov_file = os.path.join(output_dir, "covariance_matrix.csv")
+    store_dir = os.path.join(output_dir, "feature_store")
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = TrackStore(os.path.join(directory, "tracks.sqlite"))
+        try:
+            # Merge aller Daten
+            store.add_tracks(iter_tracks(os.path.join(raw_dir, "yes.py"), "yes"))
+            store.add_tracks(iter_tracks(os.path.join(raw_dir, "no.py"), "no"))
+            store.add_features(iter_features(os.path.join(raw_dir, "good.json"), "good"))
+            store.add_features(iter_features(os.path.join(raw_dir, "dislike.json"), "dislike"))
+
+            params = store.min_max(NORMALIZED_COLUMNS)
+            covariance = CovarianceAccumulator(VECTOR_COLUMNS)
+            features = FeatureStoreWriter(store_dir, store.count())
+
+            header = True
+            for chunk in store.iter_chunks(chunk_size):
+                chunk = encode_labels(normalize(chunk, params))
+                chunk.to_csv(csv_file, mode="w" if header else "a", header=header, index=False, encoding='utf-8')
+                covariance.add(chunk)
+                features.add(chunk)
+                header = False
+            if header:
+                pd.DataFrame(columns=["ID", "Name", *VECTOR_COLUMNS, "Label"]).to_csv(csv_file, index=False, encoding='utf-8')
+        finally:
+            store.close()
+
+    print(f"Die Daten wurden erfolgreich in {csv_file} gespeichert.")
+
+    covariance.result().to_csv(cov_file, index=True)
+    print(f"Kovarianzmatrix wurde in {cov_file} gespeichert.")
+
+    # Die Normalisierungsparameter (Minimum und Maximum je Merkmal) werden im Feature Store gespeichert
+    manifest = features.close(covariance.result(), params)
+    print(f"Feature Store (Version {manifest['version']}, {manifest['rows']} Tracks) wurde in {store_dir} gespeichert.")
+
+if __name__ == "__main__":
+    run_pipeline()
@@ -0,0 +1,182 @@
+import re
+import json
+import sqlite3
+
+import pandas as pd
+
+from src.utils.formatting import VECTOR_COLUMNS
+
+# Merkmale in den Audio-Features und die zugehörigen Spalten
+FEATURE_KEYS = {
+    "danceability": "Danceability",
+    "energy": "Energy",
+    "key": "Key",
+    "loudness": "Loudness",
+    "mode": "Mode",
+    "speechiness": "Speechiness",
+    "acousticness": "Acousticness",
+    "instrumentalness": "Instrumentalness",
+    "liveness": "Liveness",
+    "valence": "Valence",
+    "tempo": "Tempo",
+    "duration_ms": "Duration_ms",
+    "time_signature": "Time_Signature",
+}
+
+_WHITESPACE = re.compile(r"[\s,]*")
+
+def iter_array_items(file_path, key, block_size=1 << 16):
+    """
+    Liest die Elemente des JSON-Arrays unter 'key' nacheinander aus einer Datei, ohne sie vollständig
+    zu laden. Text vor dem Array (z.B. 'yes_ids = ' in den Python-Dateien) wird übersprungen.
+
+    :param file_path: Pfad zur Datei.
+    :param key: Name des Arrays, z.B. 'items' oder 'audio_features'.
+    :param block_size: Anzahl der Zeichen, die pro Lesevorgang gelesen werden.
+    :return: Ein Generator über die Elemente des Arrays.
+    """
+    decoder = json.JSONDecoder()
+    start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+
+    with open(file_path, "r", encoding="utf-8") as file:
+        # Anfang des Arrays suchen, das Ende des Puffers bleibt für Treffer über Blockgrenzen erhalten
+        buffer = ""
+        while True:
+            match = start.search(buffer)
+            if match:
+                buffer = buffer[match.end():]
+                break
+            block = file.read(block_size)
+            if not block:
+                raise ValueError(f"Kein Array '{key}' in {file_path} gefunden")
+            buffer = buffer[-(len(key) + 64):] + block
+
+        position = 0
+        while True:
+            position = _WHITESPACE.match(buffer, position).end()
+            if position < len(buffer) and buffer[position] == "]":
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Element ist unvollständig: nächsten Block anhängen
+                block = file.read(block_size)
+                if not block:
+                    raise ValueError(f"Unerwartetes Dateiende in {file_path}")
+                buffer = buffer[position:] + block
+                position = 0
+                continue
+            yield item
+
+def iter_tracks(file_path, label):
+    """
+    Liest die Tracks einer Playlist als Datensätze (ID, Name, Label).
+    """
+    for item in iter_array_items(file_path, "items"):
+        yield item["track"]["id"], item["track"]["name"], label
+
+def iter_features(file_path, label):
+    """
+    Liest die Audio-Features als Datensätze (ID, Merkmale in der Reihenfolge von VECTOR_COLUMNS, Label).
+    """
+    for feature in iter_array_items(file_path, "audio_features"):
+        yield feature["id"], [feature.get(key) for key in FEATURE_KEYS], label
+
+class TrackStore:
+    """
+    Führt Tracks und Audio-Features über die ID zusammen, ohne sie im Arbeitsspeicher zu halten.
+    Die Daten liegen in einer SQLite-Datei; spätere Datensätze überschreiben die Werte früherer,
+    die Reihenfolge entspricht dem ersten Auftreten einer ID.
+
+    :param path: Pfad zur SQLite-Datei.
+    :param batch_size: Anzahl der Datensätze pro Schreibvorgang.
+    """
+
+    def __init__(self, path, batch_size=10_000):
+        self.batch_size = batch_size
+        self._sequence = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=OFF;")
+        self._conn.execute("PRAGMA synchronous=OFF;")
+        # Merkmalsspalten ohne Typ, damit Zahlen unverändert (int bzw. float) gespeichert werden
+        feature_columns = ", ".join(f"{column}" for column in VECTOR_COLUMNS)
+        self._conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS tracks (
+            id TEXT PRIMARY KEY,
+            seq INTEGER,
+            name TEXT,
+            has_name INTEGER DEFAULT 0,
+            label TEXT,
+            {feature_columns}
+        );
+        """)
+
+    def _write(self, query, rows):
+        batch = []
+        for row in rows:
+            batch.append((*row[:1], self._sequence, *row[1:]))
+            self._sequence += 1
+            if len(batch) >= self.batch_size:
+                self._conn.executemany(query, batch)
+                batch = []
+        if batch:
+            self._conn.executemany(query, batch)
+        self._conn.commit()
+
+    def add_tracks(self, records):
+        """
+        Übernimmt Datensätze (ID, Name, Label), z.B. aus iter_tracks.
+        """
+        self._write("""
+        INSERT INTO tracks (id, seq, name, has_name, label) VALUES (?, ?, ?, 1, ?)
+        ON CONFLICT (id) DO UPDATE SET name = excluded.name, has_name = 1, label = excluded.label;
+        """, ((track_id, name, label) for track_id, name, label in records))
+
+    def add_features(self, records):
+        """
+        Übernimmt Datensätze (ID, Merkmale, Label), z.B. aus iter_features.
+        """
+        columns = ", ".join(VECTOR_COLUMNS)
+        placeholders = ", ".join("?" for _ in VECTOR_COLUMNS)
+        assignments = ", ".join(f"{column} = excluded.{column}" for column in VECTOR_COLUMNS)
+        self._write(f"""
+        INSERT INTO tracks (id, seq, {columns}, label) VALUES (?, ?, {placeholders}, ?)
+        ON CONFLICT (id) DO UPDATE SET {assignments}, label = excluded.label;
+        """, ((track_id, *values, label) for track_id, values, label in records))
+
+    def min_max(self, columns):
+        """
+        Minimum und Maximum je Spalte (fehlende Werte werden ignoriert).
+        """
+        aggregates = ", ".join(f"MIN({column}), MAX({column})" for column in columns)
+        values = self._conn.execute(f"SELECT {aggregates} FROM tracks;").fetchone()
+        def as_float(value):
+            return float(value) if value is not None else None
+        return {
+            "min": {column: as_float(values[2 * index]) for index, column in enumerate(columns)},
+            "max": {column: as_float(values[2 * index + 1]) for index, column in enumerate(columns)},
+        }
+
+    def count(self):
+        """
+        Anzahl der zusammengeführten Tracks.
+        """
+        return self._conn.execute("SELECT COUNT(*) FROM tracks;").fetchone()[0]
+
+    def iter_chunks(self, chunk_size=100_000):
+        """
+        Gibt die zusammengeführten Tracks in der Reihenfolge ihres ersten Auftretens als DataFrames
+        mit den Spalten ID, Name, VECTOR_COLUMNS und Label zurück.
+        """
+        cursor = self._conn.execute(f"""
+        SELECT id, CASE WHEN has_name THEN name ELSE 'Unknown' END, {", ".join(VECTOR_COLUMNS)}, label
+        FROM tracks ORDER BY seq;
+        """)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield pd.DataFrame.from_records(rows, columns=["ID", "Name", *VECTOR_COLUMNS, "Label"])
+
+    def close(self):
+        self._conn.close()
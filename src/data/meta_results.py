@@ -1,55 +1,227 @@
+import math
+
+from src.data.results_writer import RESULTS_FILE, iter_results
+
+def _context_mean(key):
+    def extract(details):
+        context = details.get("context") or {}
+        values = [ctx[key] for ctx in context.values() if ctx.get(key) is not None]
+        return sum(values) / len(values) if values else None
+    return extract
+
+# Metrics tracked per result, the key is used for the "average_<metric>" entries
+METRICS = {
+    "correctness": lambda details: details.get("correctness"),
+    "groundedness": lambda details: details.get("groundedness"),
+    "relevance_score": lambda details: (details.get("relevance") or {}).get("score"),
+    "context_relevance_score": lambda details: (details.get("context_relevance") or {}).get("score"),
+    "cosine_similarity": _context_mean("cosine similarity"),
+    "euclidean_distance": _context_mean("euclidean distance"),
+    "manhattan_distance": _context_mean("manhattan distance"),
+    "mahalanobis_distance": _context_mean("mahalanobis distance"),
+    "pearson_correlation": _context_mean("pearson correlation"),
+    "prompt_tokens": lambda details: details.get("prompt_tokens"),
+}
+
+QUANTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+
+# Up to this many distinct values, quantiles are computed exactly from value counts
+MAX_DISTINCT_VALUES = 1024
+
+class P2Quantile:
+    """
+    Approximate quantile with constant memory using the P² algorithm (Jain & Chlamtac, 1985).
+    Up to five values the quantile is computed exactly.
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        heights = self.heights
+        self.count += 1
+        if len(heights) < 5:
+            heights.append(x)
+            heights.sort()
+            return
+
+        # Find the cell containing x and adjust the extreme markers
+        if x < heights[0]:
+            heights[0] = x
+            k = 0
+        elif x >= heights[4]:
+            heights[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if heights[i] <= x < heights[i + 1])
+
+        for i in range(k + 1, 5):
+            self.positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers towards their desired positions
+        positions = self.positions
+        for i in range(1, 4):
+            d = self.desired[i] - positions[i]
+            if (d >= 1 and positions[i + 1] - positions[i] > 1) or (d <= -1 and positions[i - 1] - positions[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + d * (heights[i + d] - heights[i]) / (positions[i + d] - positions[i])
+                heights[i] = height
+                positions[i] += d
+
+    def _parabolic(self, i, d):
+        n, q = self.positions, self.heights
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self):
+        if not self.heights:
+            return None
+        if self.count > 5:
+            return self.heights[2]
+        # Exact (linearly interpolated) quantile for the first values
+        rank = self.p * (len(self.heights) - 1)
+        lower = math.floor(rank)
+        upper = min(lower + 1, len(self.heights) - 1)
+        return self.heights[lower] + (rank - lower) * (self.heights[upper] - self.heights[lower])
+
+class RunningStats:
+    """
+    Incremental statistics of one metric: Welford mean/variance, min/max and quantiles.
+    Each update is O(1) in time and memory.
+
+    Discrete metrics (e.g. binary correctness or scores on a fixed scale) have few distinct values,
+    for them the quantiles are exact nearest-rank values from a count per value, so they are always
+    values that actually occur. Once a metric exceeds MAX_DISTINCT_VALUES distinct values, the
+    counts are dropped and the P² estimates are used instead.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = None
+        self.max = None
+        self.quantiles = {name: P2Quantile(p) for name, p in QUANTILES.items()}
+        self._counts = {}
+
+    def add(self, value):
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            return
+        value = float(value)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for quantile in self.quantiles.values():
+            quantile.add(value)
+        if self._counts is not None:
+            self._counts[value] = self._counts.get(value, 0) + 1
+            if len(self._counts) > MAX_DISTINCT_VALUES:
+                self._counts = None
+
+    def _exact_quantile(self, p):
+        # Nearest rank: the smallest value whose cumulative count reaches ceil(p * n)
+        rank = max(1, math.ceil(p * self.count - 1e-9))
+        cumulative = 0
+        for value in sorted(self._counts):
+            cumulative += self._counts[value]
+            if cumulative >= rank:
+                return value
+
+    def quantile(self, name):
+        if not self.count:
+            return None
+        if self._counts is not None:
+            return self._exact_quantile(QUANTILES[name])
+        return self.quantiles[name].value()
+
+    @property
+    def variance(self):
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean": self.mean if self.count else None,
+            "variance": self.variance if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            **{name: self.quantile(name) for name in QUANTILES},
+        }
+
+class MetaResultsAggregator:
+    """
+    Aggregates the evaluation results one at a time, overall and per label.
+    Missing values (None) are skipped, so averages are taken over the tracks that have the metric.
+    """
+
+    def __init__(self):
+        self.total_tracks = 0
+        self.overall = {metric: RunningStats() for metric in METRICS}
+        self.labels = {}
+
+    def add(self, details):
+        self.total_tracks += 1
+        label = details.get("label")
+        if label not in self.labels:
+            self.labels[label] = {"total_tracks": 0, "metrics": {metric: RunningStats() for metric in METRICS}}
+        by_label = self.labels[label]
+        by_label["total_tracks"] += 1
+
+        for metric, extract in METRICS.items():
+            value = extract(details)
+            self.overall[metric].add(value)
+            by_label["metrics"][metric].add(value)
+
+    def postfix(self):
+        """
+        Short summary of the current means for a progress bar.
+        """
+        return {
+            metric: round(self.overall[metric].mean, 3)
+            for metric in ["correctness", "groundedness", "relevance_score"]
+            if self.overall[metric].count
+        }
+
+    def summary(self):
+        overall_meta_results = {"total_tracks": self.total_tracks}
+        for metric, stats in self.overall.items():
+            overall_meta_results[f"average_{metric}"] = stats.mean if stats.count else 0
+        overall_meta_results["distributions"] = {metric: stats.to_dict() for metric, stats in self.overall.items()}
+        overall_meta_results["by_label"] = {
+            str(label): {
+                "total_tracks": by_label["total_tracks"],
+                "distributions": {metric: stats.to_dict() for metric, stats in by_label["metrics"].items()},
+            }
+            for label, by_label in self.labels.items()
+        }
+        return overall_meta_results
+
 def generate_meta_results(data):
-    overall_meta_results = {
-        "total_tracks": len(data),
-        "average_correctness": 0,
-        "average_groundedness": 0,
-        "average_relevance_score": 0,
-        "average_context_relevance_score": 0,
-        "average_cosine_similarity": 0,
-        "average_euclidean_distance": 0,
-        "average_manhattan_distance": 0,
-        "average_mahalanobis_distance": 0,
-        "average_pearson_correlation": 0
-    }
-    
-    # Summing up the metrics across all tracks
-    for details in data.values():
-        overall_meta_results["average_correctness"] += details["correctness"]
-        overall_meta_results["average_groundedness"] += details["groundedness"]
-        overall_meta_results["average_relevance_score"] += details["relevance"]["score"]
-        overall_meta_results["average_context_relevance_score"] += details["context_relevance"]["score"]
-        
-        overall_meta_results["average_cosine_similarity"] += sum(
-            [ctx["cosine similarity"] for ctx in details["context"].values()]
-        ) / len(details["context"])
-        
-        overall_meta_results["average_euclidean_distance"] += sum(
-            [ctx["euclidean distance"] for ctx in details["context"].values()]
-        ) / len(details["context"])
-        
-        overall_meta_results["average_manhattan_distance"] += sum(
-            [ctx["manhattan distance"] for ctx in details["context"].values()]
-        ) / len(details["context"])
-        
-        overall_meta_results["average_mahalanobis_distance"] += sum(
-            [ctx["mahalanobis distance"] for ctx in details["context"].values()]
-        ) / len(details["context"])
-        
-        overall_meta_results["average_pearson_correlation"] += sum(
-            [ctx["pearson correlation"] for ctx in details["context"].values()]
-        ) / len(details["context"])
-    
-    # Calculate averages
-    total_tracks = overall_meta_results["total_tracks"]
-    if total_tracks > 0:
-        overall_meta_results["average_correctness"] /= total_tracks
-        overall_meta_results["average_groundedness"] /= total_tracks
-        overall_meta_results["average_relevance_score"] /= total_tracks
-        overall_meta_results["average_context_relevance_score"] /= total_tracks
-        overall_meta_results["average_cosine_similarity"] /= total_tracks
-        overall_meta_results["average_euclidean_distance"] /= total_tracks
-        overall_meta_results["average_manhattan_distance"] /= total_tracks
-        overall_meta_results["average_mahalanobis_distance"] /= total_tracks
-        overall_meta_results["average_pearson_correlation"] /= total_tracks
-    
-    return overall_meta_results
\ No newline at end of file
+    # data can be a dict {id: result} or any iterable of results (e.g. streamed from a file)
+    if isinstance(data, dict):
+        data = data.values()
+
+    aggregator = MetaResultsAggregator()
+    for details in data:
+        aggregator.add(details)
+    return aggregator.summary()
+
+def meta_results_from_file(path=RESULTS_FILE):
+    """
+    Computes the meta results from a JSONL results file without loading it into memory.
+    """
+    return generate_meta_results(result for _, result in iter_results(path))
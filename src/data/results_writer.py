@@ -0,0 +1,116 @@
+import os
+import json
+import threading
+import textwrap
+
+import numpy as np
+
+RESULTS_FILE = "src/data/results/results.jsonl"
+
+def _to_builtin(value):
+    # NumPy-Skalare (z.B. aus np.mean) in Python-Zahlen umwandeln
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def iter_results(path=RESULTS_FILE):
+    """
+    Liest die Ergebnisse zeilenweise aus einer JSONL-Datei, ohne sie vollständig zu laden.
+    Eine unvollständige letzte Zeile (z.B. nach einem Absturz) wird übersprungen.
+
+    :return: Ein Generator über Tupel (ID, Ergebnis).
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if not line.endswith("\n"):
+                break
+            entry = json.loads(line)
+            yield entry["id"], entry["result"]
+
+class ResultsWriter:
+    """
+    Schreibt die Ergebnisse der Evaluation fortlaufend in eine JSONL-Datei (eine Zeile pro Track).
+    Die Datei wird nur erweitert und in Abständen mit fsync auf die Platte geschrieben, sodass bei
+    einem Abbruch höchstens die letzten Ergebnisse verloren gehen.
+
+    :param path: Pfad zur JSONL-Datei.
+    :param resume: Ob bestehende Ergebnisse übernommen (True) oder verworfen (False) werden.
+    :param fsync_interval: Anzahl der Ergebnisse zwischen zwei fsync-Aufrufen.
+    """
+
+    def __init__(self, path=RESULTS_FILE, resume=False, fsync_interval=50):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.recorded_ids = set()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if resume and os.path.exists(path):
+            valid_bytes = 0
+            with open(path, "rb") as file:
+                for line in file:
+                    if not line.endswith(b"\n"):
+                        break
+                    self.recorded_ids.add(json.loads(line)["id"])
+                    valid_bytes += len(line)
+            # Unvollständige letzte Zeile abschneiden, damit die Datei gültig bleibt
+            with open(path, "r+b") as file:
+                file.truncate(valid_bytes)
+            self._file = open(path, "a", encoding="utf-8")
+        else:
+            self._file = open(path, "w", encoding="utf-8")
+
+    def write(self, record_id, result):
+        """
+        Hängt das Ergebnis eines Tracks an die Datei an.
+        """
+        line = json.dumps({"id": record_id, "result": result}, default=_to_builtin)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.recorded_ids.add(record_id)
+            self._pending += 1
+            if self._pending >= self.fsync_interval:
+                os.fsync(self._file.fileno())
+                self._pending = 0
+
+    def close(self):
+        """
+        Schreibt ausstehende Ergebnisse auf die Platte und schließt die Datei.
+        """
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+def write_overall_results(meta_results, output_path, path=RESULTS_FILE):
+    """
+    Schreibt die Gesamtergebnisse im Format von overall_results.json, wobei die einzelnen
+    Ergebnisse nacheinander aus der JSONL-Datei gelesen und direkt geschrieben werden.
+
+    :param meta_results: Die Meta-Ergebnisse über alle Tracks.
+    :param output_path: Pfad der JSON-Datei.
+    :param path: Pfad zur JSONL-Datei mit den Ergebnissen.
+    """
+    def dump(value, level):
+        # Entspricht json.dump(indent=4) für einen Wert auf der Verschachtelungsebene 'level'
+        return textwrap.indent(json.dumps(value, indent=4, default=_to_builtin), " " * 4 * level).lstrip(" ")
+
+    with open(output_path, "w", encoding="utf-8") as file:
+        file.write("{\n")
+        file.write(f'    "meta results": {dump(meta_results, 1)},\n')
+        file.write('    "results": {')
+        first = True
+        for record_id, result in iter_results(path):
+            file.write("\n" if first else ",\n")
+            file.write(f"        {json.dumps(record_id)}: {dump(result, 2)}")
+            first = False
+        file.write("}\n}" if first else "\n    }\n}")
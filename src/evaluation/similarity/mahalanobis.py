@@ -1,10 +1,39 @@
+import threading
 import numpy as np
-import pandas as pd
 
-def mahalanobis_distance(vec1, vec2):
-    cov_matrix_df = pd.read_csv("src/data/preprocessed/covariance_matrix.csv", index_col=0)
+from src.utils.feature_store import FEATURE_STORE_DIR, load_feature_store
+
+_whitening_matrices = {}
+_lock = threading.Lock()
+
+def whitening_from_covariance(cov_matrix):
+    """
+    Berechnet die Whitening-Matrix W = L⁻¹ aus der Cholesky-Zerlegung Σ = L·Lᵀ.
+    Damit gilt: Mahalanobis(x, y) = ||W·(x - y)||.
+    Ist die Matrix nicht positiv definit, wird auf eine Eigenzerlegung ausgewichen.
+    """
+    try:
+        lower = np.linalg.cholesky(cov_matrix)
+        return np.linalg.inv(lower)
+    except np.linalg.LinAlgError:
+        eigenvalues, eigenvectors = np.linalg.eigh(cov_matrix)
+        keep = eigenvalues > eigenvalues.max() * 1e-12
+        return (eigenvectors[:, keep] / np.sqrt(eigenvalues[keep])).T
 
+def load_whitening_matrix(directory=FEATURE_STORE_DIR):
+    """
+    Gibt die Whitening-Matrix zur Kovarianzmatrix des Feature Stores zurück. Sie wird pro Version
+    des Stores nur einmal berechnet, nach einer neuen Vorverarbeitung also automatisch aktualisiert.
+    """
+    store = load_feature_store(directory)
+    key = (store.directory, store.version)
+    with _lock:
+        if key not in _whitening_matrices:
+            _whitening_matrices[key] = whitening_from_covariance(store.covariance)
+        return _whitening_matrices[key]
+
+def mahalanobis_distance(vec1, vec2):
     diff = np.array(vec1) - np.array(vec2)
-    inv_cov_matrix = np.linalg.inv(cov_matrix_df.values)
-    distance = np.sqrt(np.dot(np.dot(diff.T, inv_cov_matrix), diff))
-    return distance
\ No newline at end of file
+    whitened = load_whitening_matrix() @ diff
+    distance = np.sqrt(np.dot(whitened, whitened))
+    return distance
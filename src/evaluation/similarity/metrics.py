@@ -1,42 +1,138 @@
-import json
-from src.evaluation.similarity.mahalanobis import mahalanobis_distance
-from src.evaluation.similarity.pearson import pearson_correlation
-from src.evaluation.similarity.manhattan import manhattan_distance
-from src.evaluation.similarity.euclidean import euclidean_distance
-from src.evaluation.similarity.cosine import cosine_similarity
+import numpy as np
+from src.evaluation.similarity.mahalanobis import load_whitening_matrix
+from src.utils.context import parse_embedding
+from src.utils.feature_store import FEATURE_STORE_DIR
 
-def calculate_all_metrics(vec1, vec2):
-    metrics = {}
+class SimilarityMetrics:
+    """
+    Berechnet alle fünf Ähnlichkeitsmetriken vektorisiert mit NumPy.
+
+    Die Kovarianzmatrix wird per Cholesky-Zerlegung in eine Whitening-Matrix überführt, die
+    Mahalanobis-Distanz ist danach eine euklidische Norm. Die Matrix wird nicht in der Instanz
+    gespeichert, sondern über den Cache pro Version des Feature Stores geladen, damit eine geteilte
+    Instanz nach einer neuen Vorverarbeitung nicht mit der alten Kovarianzmatrix weiterrechnet.
+
+    :param feature_store: Verzeichnis des Feature Stores mit der Kovarianzmatrix.
+    """
+
+    def __init__(self, feature_store=FEATURE_STORE_DIR):
+        self.feature_store = feature_store
+
+    @property
+    def whitening(self):
+        return load_whitening_matrix(self.feature_store)
+
+    def compute_batch(self, queries, neighbors):
+        """
+        Berechnet die Metriken für mehrere Anfragen gegen ihre jeweiligen Top-k Tracks.
+
+        :param queries: Anfragevektoren der Form (B, d).
+        :param neighbors: Embeddings der Top-k Tracks der Form (B, k, d).
+        :return: Ein Dictionary mit einem Array der Form (B, k) pro Metrik.
+        """
+        queries = np.asarray(queries, dtype=np.float64)
+        neighbors = np.asarray(neighbors, dtype=np.float64)
+        diff = neighbors - queries[:, None, :]
+        whitening = self.whitening
+
+        query_norms = np.linalg.norm(queries, axis=-1)[:, None]
+        neighbor_norms = np.linalg.norm(neighbors, axis=-1)
+        dot = np.einsum("bkd,bd->bk", neighbors, queries)
+
+        centered_queries = queries - queries.mean(axis=-1, keepdims=True)
+        centered_neighbors = neighbors - neighbors.mean(axis=-1, keepdims=True)
+        covariance = np.einsum("bkd,bd->bk", centered_neighbors, centered_queries)
+        deviations = np.linalg.norm(centered_neighbors, axis=-1) * np.linalg.norm(centered_queries, axis=-1)[:, None]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cosine = dot / (neighbor_norms * query_norms)
+            pearson = np.where(deviations != 0, covariance / deviations, 0.0)
+
+        return {
+            "Cosine Similarity": cosine,
+            "Euclidean Distance": np.linalg.norm(diff, axis=-1),
+            "Manhattan Distance": np.abs(diff).sum(axis=-1),
+            "Mahalanobis Distance": np.linalg.norm(diff @ whitening.T, axis=-1),
+            "Pearson Correlation": pearson,
+        }
+
+    def compute(self, query, neighbors):
+        """
+        Berechnet die Metriken für eine Anfrage gegen die Matrix ihrer Top-k Tracks.
 
+        :param query: Anfragevektor der Länge d.
+        :param neighbors: Embeddings der Top-k Tracks der Form (k, d).
+        :return: Ein Dictionary mit einem Array der Länge k pro Metrik.
+        """
+        neighbors = np.asarray(neighbors, dtype=np.float64).reshape(-1, len(query))
+        batch = self.compute_batch([query], neighbors[None, :, :])
+        return {name: values[0] for name, values in batch.items()}
+
+_metrics_engine = None
+
+def get_metrics_engine():
+    """
+    Gibt die geteilte Instanz von SimilarityMetrics zurück (wird beim ersten Aufruf erzeugt).
+    Die Whitening-Matrix folgt dabei immer der aktuellen Version des Feature Stores.
+    """
+    global _metrics_engine
+    if _metrics_engine is None:
+        _metrics_engine = SimilarityMetrics()
+    return _metrics_engine
+
+def calculate_all_metrics(vec1, vec2):
     # Metriken berechnen
-    metrics["Cosine Similarity"] = cosine_similarity(vec1, vec2)
-    metrics["Euclidean Distance"] = euclidean_distance(vec1, vec2)
-    metrics["Manhattan Distance"] = manhattan_distance(vec1, vec2)
-    metrics["Mahalanobis Distance"] = mahalanobis_distance(vec1, vec2)
-    metrics["Pearson Correlation"] = pearson_correlation(vec1, vec2)
-    
-    return metrics
+    metrics = get_metrics_engine().compute(vec1, [vec2])
+    return {name: float(values[0]) for name, values in metrics.items()}
 
-def similarity(input_vector, similar_tracks):
-    # Ergebnisse speichern und Metriken berechnen
-    metrics_results = []  # Speichert die berechneten Metriken für jeden Track
-
-    for idx, track in enumerate(similar_tracks):
-        track_id = track["id"]
-        track_name = track["name"]
-        track_label = track["label"]  # Das Label aus similar_tracks
-        track_features = json.loads(track["embedding"])  # Annahme: Embedding ist JSON-String
-        
-        # Metriken berechnen
-        metrics = calculate_all_metrics(input_vector, track_features)
-        
-        # Ergebnisse in einer Liste speichern
-        metrics_results.append({
+def _metrics_results(similar_tracks, track_features, metrics):
+    # Ergebnisse in einer Liste speichern
+    return [
+        {
             "Rang": idx + 1,
-            "ID": track_id,
-            "Name": track_name,
-            "Label": track_label,  # Das Label hinzufügen
-            "Embeddings": track_features,
-            **metrics
-        })
-    return metrics_results
\ No newline at end of file
+            "ID": track["id"],
+            "Name": track["name"],
+            "Label": track["label"],  # Das Label aus similar_tracks
+            "Embeddings": features,
+            **{name: float(values[idx]) for name, values in metrics.items()}
+        }
+        for idx, (track, features) in enumerate(zip(similar_tracks, track_features))
+    ]
+
+def similarity(input_vector, similar_tracks):
+    # Embeddings einmal parsen (Annahme: Embedding ist JSON-String) und alle Metriken auf einmal berechnen
+    track_features = [parse_embedding(track["embedding"]) for track in similar_tracks]
+    if not track_features:
+        return []
+
+    metrics = get_metrics_engine().compute(input_vector, track_features)
+    return _metrics_results(similar_tracks, track_features, metrics)
+
+def similarity_many(input_vectors, similar_tracks_list):
+    """
+    Berechnet die Metriken für mehrere Anfragen. Anfragen mit gleicher Anzahl an Top-k Tracks
+    werden gemeinsam in einem Batch berechnet.
+
+    :return: Eine Liste mit den Ergebnissen von similarity() pro Anfrage.
+    """
+    track_features = [[parse_embedding(track["embedding"]) for track in tracks] for tracks in similar_tracks_list]
+    results = [[] for _ in input_vectors]
+
+    groups = {}
+    for index, features in enumerate(track_features):
+        if features:
+            groups.setdefault(len(features), []).append(index)
+
+    engine = get_metrics_engine()
+    for indices in groups.values():
+        metrics = engine.compute_batch(
+            [input_vectors[index] for index in indices],
+            [track_features[index] for index in indices]
+        )
+        for position, index in enumerate(indices):
+            results[index] = _metrics_results(
+                similar_tracks_list[index],
+                track_features[index],
+                {name: values[position] for name, values in metrics.items()}
+            )
+    return results
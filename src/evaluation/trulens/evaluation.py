@@ -2,20 +2,93 @@ import numpy as np
 
 from src.utils.formatting import vector_to_query
 
-def evaluate_trulens(provider, input_vector, rag, ground_truth):
+GROUNDEDNESS_MODES = ["per-chunk", "batched"]
+
+# Prompt für die gebündelte Groundedness: alle Kontext-Abschnitte werden in einer Anfrage bewertet.
+# Die Summe der Einzelbewertungen (0-3 je Abschnitt) wird vom Provider auf [0, 1] normiert
+# und entspricht damit dem Mittelwert der Einzelbewertungen.
+BATCHED_GROUNDEDNESS_SYSTEM_PROMPT = (
+    "You are an INFORMATION OVERLAP classifier; providing the overlap of information between a SOURCE and several numbered STATEMENTS.\n"
+    "For each STATEMENT, rate on an integer scale from 0 to 3 how well the information in the STATEMENT is supported by the SOURCE, "
+    "where 0 means not supported at all and 3 means fully supported.\n"
+    "Finally, add up the ratings of all statements.\n"
+    "Respond only in the following format:\n"
+    "Criteria: <Statement number followed by its rating, one per line>\n"
+    "Supporting Evidence: <Short explanation for the ratings>\n"
+    "Score: <Sum of all ratings as a single integer>"
+)
+
+def _batched_groundedness(provider, query, texts, max_batch_chars, limits):
+    """
+    Bewertet die Groundedness aller Kontext-Abschnitte in möglichst wenigen Anfragen.
+    Abschnitte werden zu Gruppen von höchstens max_batch_chars Zeichen zusammengefasst.
+
+    :return: Der Mittelwert der Groundedness über alle Abschnitte.
+    """
+    groups = [[]]
+    group_chars = 0
+    for text in texts:
+        if groups[-1] and group_chars + len(text) > max_batch_chars:
+            groups.append([])
+            group_chars = 0
+        groups[-1].append(text)
+        group_chars += len(text)
+
+    scores = []
+    for group in groups:
+        statements = "\n\n".join(f"STATEMENT {number}:\n{text}" for number, text in enumerate(group, start=1))
+        with limits.stage("evaluation"):
+            score, _ = provider.generate_score_and_reasons(
+                BATCHED_GROUNDEDNESS_SYSTEM_PROMPT,
+                f"SOURCE:\n{query}\n\n{statements}",
+                min_score_val=0,
+                max_score_val=3 * len(group),
+            )
+        # Gewichtung mit der Anzahl der Abschnitte, damit alle Abschnitte gleich zählen
+        scores.extend([score] * len(group))
+    return np.mean(scores)
+
+def evaluate_trulens(provider, input_vector, rag, ground_truth, groundedness_mode="per-chunk", max_batch_chars=8000, skip_combined_context=False):
+    """
+    Generiert eine Antwort für den Eingabevektor und bewertet sie mit den TruLens-Feedback-Funktionen.
+    Ist provider None, werden keine Feedback-Funktionen aufgerufen und die Bewertungen sind None.
+
+    :param groundedness_mode: 'per-chunk' (eine Anfrage pro Kontext-Abschnitt) oder 'batched'
+                              (alle Abschnitte in einer bzw. wenigen Anfragen).
+    :param max_batch_chars: Maximale Zeichenanzahl der Abschnitte pro gebündelter Anfrage.
+    :param skip_combined_context: Ob die zusammengefasste Tabelle am Ende des Kontexts bei der
+                                  Groundedness übersprungen wird, da sie nur die Einzeltabellen wiederholt.
+    """
+    if groundedness_mode not in GROUNDEDNESS_MODES:
+        raise ValueError("Ungültiger Groundedness-Modus. Wähle zwischen 'per-chunk' oder 'batched'.")
 
     query = vector_to_query(input_vector)
 
-    context = rag.retrieve(query=query)
+    # Den ungerundeten Vektor übergeben, damit die Suche aus dem RetrievalMemo beantwortet wird
+    context = rag.retrieve(query=query, vector=input_vector)
+
+    response = rag.generate_completion(query=query, context_str=context, vector=input_vector)
+
+    # Ohne Evaluierungsmodell werden nur Antwort und Korrektheit bestimmt
+    groundedness = None
+    relevance = context_relevance = (None, None)
+    if provider is not None:
+        texts = context[:-1] if skip_combined_context and len(context) > 1 else context
 
-    response = rag.generate_completion(query=query, context_str=context)
+        # Aufrufe an den Evaluierungs-Provider werden über die Stufe 'evaluation' begrenzt
+        if groundedness_mode == "batched" and texts:
+            groundedness = _batched_groundedness(provider, query, texts, max_batch_chars, rag.limits)
+        else:
+            groundedness = []
+            for text in texts:
+                with rag.limits.stage("evaluation"):
+                    groundedness.append(provider.groundedness_measure_with_cot_reasons(query, text)[0])
+            groundedness = np.mean(groundedness)
 
-    groundedness = []
-    for text in context:
-        groundedness.append(provider.groundedness_measure_with_cot_reasons(query, text)[0])
-    
-    relevance = provider.relevance_with_cot_reasons(query, response)
-    context_relevance = provider.context_relevance_with_cot_reasons(query, context)
+        with rag.limits.stage("evaluation"):
+            relevance = provider.relevance_with_cot_reasons(query, response)
+        with rag.limits.stage("evaluation"):
+            context_relevance = provider.context_relevance_with_cot_reasons(query, context)
 
     if ground_truth != None:
         correctness = 1 if response==ground_truth else 0
@@ -25,8 +98,9 @@ def evaluate_trulens(provider, input_vector, rag, ground_truth):
     return {
         "label": ground_truth,
         "response" : response,
+        "prompt_tokens": rag.prompt_tokens(query, context),
         "correctness" : correctness,
-        "groundedness": np.mean(groundedness),
+        "groundedness": groundedness,
         "relevance": {
             "score": relevance[0],
             "reasons": relevance[1]
@@ -35,4 +109,4 @@ def evaluate_trulens(provider, input_vector, rag, ground_truth):
             "score": context_relevance[0],
             "reasons": context_relevance[1]
         }
-    }
\ No newline at end of file
+    }
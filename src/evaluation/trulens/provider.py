@@ -0,0 +1,108 @@
+import time
+import random
+
+from src.utils.rate_limit import estimate_tokens
+
+class CachedProvider:
+    """
+    Hülle um einen TruLens-Provider, die die Ergebnisse der Feedback-Funktionen in einem
+    DiskCache speichert. Schlüssel sind Feedback-Typ, Evaluierungsmodell und Eingaben, sodass
+    identische Bewertungen über mehrere Läufe hinweg nur einmal beim Modell angefragt werden.
+    Alle übrigen Attribute werden unverändert an den Provider weitergereicht.
+
+    :param provider: Der TruLens-Provider, z.B. trulens.providers.openai.OpenAI.
+    :param cache: Ein DiskCache für die Feedback-Ergebnisse.
+    :param model: Name des Evaluierungsmodells (Standard: model_engine des Providers).
+    """
+
+    CACHED_METHODS = [
+        "groundedness_measure_with_cot_reasons",
+        "relevance_with_cot_reasons",
+        "context_relevance_with_cot_reasons",
+        "generate_score_and_reasons",
+    ]
+
+    def __init__(self, provider, cache, model=None):
+        self.provider = provider
+        self.cache = cache
+        self.model = model or getattr(provider, "model_engine", None)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.provider, name)
+        if name not in self.CACHED_METHODS:
+            return attribute
+
+        def cached(*args, **kwargs):
+            key = self.cache.make_key(name, self.model, args, kwargs)
+            value = self.cache.get(key)
+            if value is not None:
+                # JSON speichert Tupel als Listen, die Feedback-Funktionen liefern (Score, Begründung)
+                return tuple(value) if isinstance(value, list) else value
+
+            result = attribute(*args, **kwargs)
+            self.cache.set(key, result)
+            return result
+
+        return cached
+
+class ScheduledProvider:
+    """
+    Hülle um einen TruLens-Provider, die die Anfragen an das Evaluierungsmodell über den gemeinsamen
+    RateLimitScheduler einplant. Wird das Rate-Limit trotzdem überschritten (429), wird das
+    Parallelitätslimit gesenkt und die Anfrage mit exponentiellem Backoff wiederholt.
+
+    Die Feedback-Funktionen stellen intern mehrere Anfragen (z.B. Groundedness eine pro Aussage),
+    daher wird die einzelne Modellanfrage des Providers (LLM_METHOD) eingeplant und nicht nur der
+    äußere Aufruf. Fehlt diese Methode, werden ersatzweise die Feedback-Funktionen eingeplant.
+
+    :param provider: Der TruLens-Provider, z.B. trulens.providers.openai.OpenAI.
+    :param scheduler: Der RateLimitScheduler, der auch für die Generierung verwendet wird.
+    :param model: Name des Evaluierungsmodells (Standard: model_engine des Providers).
+    :param max_retries: Maximale Anzahl an Wiederholungen nach einem 429.
+    """
+
+    # Methode der TruLens-Provider, über die jede Anfrage an das Modell läuft
+    LLM_METHOD = "_create_chat_completion"
+    SCHEDULED_METHODS = CachedProvider.CACHED_METHODS
+
+    def __init__(self, provider, scheduler, model=None, max_retries=5):
+        self.provider = provider
+        self.scheduler = scheduler
+        self.model = model or getattr(provider, "model_engine", None)
+        self.max_retries = max_retries
+        self.scheduled_methods = self.SCHEDULED_METHODS
+
+        completion = getattr(provider, self.LLM_METHOD, None)
+        if completion is not None:
+            # Provider sind Pydantic-Modelle, die Methode wird daher direkt an der Instanz ersetzt
+            object.__setattr__(provider, self.LLM_METHOD, self._schedule(completion))
+            self.scheduled_methods = []
+
+    @staticmethod
+    def _is_rate_limit(error):
+        return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+    def _schedule(self, function):
+        def scheduled(*args, **kwargs):
+            model_scheduler = self.scheduler.for_model(self.model)
+            tokens = estimate_tokens([args, kwargs])
+            for attempt in range(self.max_retries + 1):
+                try:
+                    with model_scheduler.slot(tokens):
+                        result = function(*args, **kwargs)
+                except Exception as e:
+                    if not self._is_rate_limit(e) or attempt == self.max_retries:
+                        raise
+                    model_scheduler.record(429, {})
+                    time.sleep(random.uniform(0, min(30.0, 0.5 * 2 ** attempt)))
+                    continue
+                model_scheduler.record(200, {})
+                return result
+
+        return scheduled
+
+    def __getattr__(self, name):
+        attribute = getattr(self.provider, name)
+        if name not in self.scheduled_methods:
+            return attribute
+        return self._schedule(attribute)
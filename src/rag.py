@@ -1,233 +1,269 @@
-import os
-import requests
-from src.utils.connect_db import connect_to_db
-from src.utils.formatting import query_to_vector
+from src.utils.connect_db import ConnectionPool
+from src.utils.context import CONTEXT_MODES, count_tokens, render_compact_context, render_context
+from src.utils.formatting import query_to_vector, vector_to_literal
+from src.utils.retrieval import RetrievalMemo, build_search_query, get_search_metric, normalize_metric, prepare_query_vector, rows_to_dicts
+from src.utils.numpy_retrieval import BACKENDS, NumpyRetriever
+from src.utils.concurrency import StageLimits
+from src.utils.knn_vote import KNN_MODELS, knn_vote
+from src.utils.llm_client import LLMClient
+from src.utils.rate_limit import RateLimitScheduler
+from src.setup.tune_index import apply_session_settings, session_settings
 from trulens.apps.custom import instrument
-from openai import OpenAI
 
 class RAG:
 
-    def __init__(self, model_name, limit, metric):
+    def __init__(self, model_name, limit, metric, pool=None, pool_min_size=None, pool_max_size=None, batch_size=256, backend="pgvector", limits=None, cache=None, llm_client=None, scheduler=None,
+                 context_mode="tables", context_tokens=None):
         self.model_name = model_name
         self.limit = limit
-        self.metric = metric
+        self.metric = normalize_metric(metric)
+        # Anzahl der Vektoren pro Abfrage in retrieve_many
+        self.batch_size = batch_size
+        # Retrieval-Backend: 'pgvector' (Datenbank) oder 'numpy'/'kdtree' (im Arbeitsspeicher)
+        if backend not in BACKENDS:
+            raise ValueError("Ungültiges Backend. Wähle zwischen 'pgvector', 'numpy' oder 'kdtree'.")
+        self.backend = backend
+        self.retriever = None
+        if backend != "pgvector":
+            self.retriever = NumpyRetriever(self.metric, limit, kdtree=backend == "kdtree")
+        # Darstellung des Kontexts ('tables' oder 'compact') und Token-Budget für den kompakten Kontext
+        if context_mode not in CONTEXT_MODES:
+            raise ValueError("Ungültiger Kontext-Modus. Wähle zwischen 'tables' oder 'compact'.")
+        self.context_mode = context_mode
+        self.context_tokens = context_tokens
+        # Ergebnisse der Similarity Search für die Dauer des Laufs, jede Anfrage geht nur einmal an die Datenbank
+        self.retrieval_memo = RetrievalMemo()
+        # Optionaler DiskCache für generierte Antworten, Schlüssel: Modellname und Nachrichten
+        self.cache = cache
+        # Begrenzung gleichzeitiger Aufrufe je Stufe ('db', 'generation', 'evaluation')
+        self.limits = limits if limits is not None else StageLimits()
+        # Verbindungspool für die gesamte Lebensdauer der RAG-Instanz
+        self.pool = pool if pool is not None else ConnectionPool(
+            min_size=pool_min_size, max_size=pool_max_size, configure=self._configure_session
+        )
+        # HTTP-Client für die Generierungsmodelle mit Keep-Alive-Verbindungen, Timeouts und Retries
+        self._owns_llm_client = llm_client is None
+        # Gemeinsamer RateLimitScheduler für Anfragen an die Modelle (Anfragen und Tokens pro Minute)
+        self.scheduler = scheduler if scheduler is not None else RateLimitScheduler()
+        self.llm_client = llm_client if llm_client is not None else LLMClient(scheduler=self.scheduler)
+
+    def _configure_session(self, conn):
+        """
+        Setzt die Suchparameter des Index (z.B. hnsw.ef_search, getunt und mindestens limit + 1)
+        für eine neue Datenbank-Session.
+        """
+        apply_session_settings(conn, session_settings(conn, self.metric, self.limit))
+
+    def close(self):
+        """
+        Schließt die Verbindungen des Pools und des HTTP-Clients und verwirft das RetrievalMemo.
+        """
+        self.retrieval_memo.clear()
+        self.pool.close()
+        if self._owns_llm_client:
+            self.llm_client.close()
 
 
     def retrieve_only(self, query) -> list:
         """
         Führt eine Similarity Search mit einer wählbaren Metrik durch und gibt die Ergebnisse als Dictionary zurück.
+        Bereits gesuchte Vektoren werden aus dem RetrievalMemo beantwortet.
 
         :param input_vector: Der Vektor, nach dem gesucht wird (Liste von Zahlen).
         :param limit: Die maximale Anzahl von Ergebnissen.
-        :param metric: Die Metrik für die Similarity Search ('cosine', 'euclidean', 'inner_product').
+        :param metric: Die Metrik für die Similarity Search ('cosine', 'euclidean', 'inner_product', 'manhattan', 'mahalanobis', 'pearson').
         :return: Ein Dictionary mit den Ergebnissen.
         """
-        conn = connect_to_db()
-        cursor = conn.cursor()
+        key = RetrievalMemo.make_key(query, self.metric, self.limit)
+        return self.retrieval_memo.get_or_compute(key, lambda: self._search(query))
 
-        # Wähle den passenden Operator basierend auf der Metrik
-        if self.metric == "cosine":
-            operator = "<=>"
-        elif self.metric == "euclidean":
-            operator = "<->"
-        elif self.metric == "inner_product":
-            operator = "<#>"
-        else:
-            raise ValueError("Ungültige Metrik. Wähle zwischen 'cosine', 'euclidean' oder 'inner_product'.")
+    def _search(self, query) -> list:
+        if self.retriever is not None:
+            return self.retriever.search([query])[0]
+
+        # SQL-Abfrage für Similarity Search (identische Embeddings werden ausgeschlossen)
+        query = build_search_query(self.metric, query, include_identical=False)
 
-        # Eingabevektor in ein String-Format umwandeln
-        vector_str = ','.join(map(str, query))
+        # Query über eine Verbindung aus dem Pool ausführen
+        with self.limits.stage("db"), self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, (self.limit,))
+            results = cursor.fetchall()
+            cursor.close()
 
-        # SQL-Abfrage für Similarity Search
+        # Ergebnisse in ein Dictionary umwandeln
+        return rows_to_dicts(results)
+
+    def retrieve_many(self, vectors, batch_size=None) -> list:
+        """
+        Führt die Similarity Search für mehrere Vektoren durch. Pro Batch wird nur eine
+        SQL-Abfrage gesendet: die Vektoren werden als Array übergeben, per unnest entpackt
+        und über einen LATERAL-Join jeweils gegen 'track' gesucht. Beim NumPy-Backend wird
+        ein Batch über ein einziges Matrixprodukt beantwortet. Gesucht werden nur Vektoren,
+        die noch nicht im RetrievalMemo liegen, jeder davon nur einmal; läuft die Suche für einen
+        Vektor bereits in einem anderen Thread, wird auf deren Ergebnis gewartet.
+
+        :param vectors: Liste von Vektoren (Listen von Zahlen).
+        :param batch_size: Anzahl der Vektoren pro Abfrage (Standard: self.batch_size).
+        :return: Eine Liste mit einer Ergebnisliste pro Vektor, in der Reihenfolge der Eingabe.
+        """
+        keys = [RetrievalMemo.make_key(vector, self.metric, self.limit) for vector in vectors]
+
+        # Nur Vektoren suchen, für die noch keine Suche vorliegt oder läuft (auch in anderen Threads),
+        # doppelte Vektoren erhalten dasselbe Future
+        futures = []
+        owned = {}
+        for index, key in enumerate(keys):
+            future, owner = self.retrieval_memo.claim(key)
+            futures.append(future)
+            if owner:
+                owned[key] = (index, future)
+
+        try:
+            searched = self._search_many([vectors[index] for index, _ in owned.values()], batch_size)
+        except BaseException as e:
+            for key, (_, future) in owned.items():
+                self.retrieval_memo.fail(key, future, e)
+            raise
+        for (_, future), result in zip(owned.values(), searched):
+            future.set_result(result)
+
+        # Auf Suchen anderer Threads warten
+        return [future.result() for future in futures]
+
+    def _search_many(self, vectors, batch_size=None) -> list:
+        if not vectors:
+            return []
+        batch_size = batch_size or self.batch_size
+        if self.retriever is not None:
+            results = []
+            for start in range(0, len(vectors), batch_size):
+                results.extend(self.retriever.search(vectors[start:start + batch_size]))
+            return results
+
+        search_metric = get_search_metric(self.metric)
+        column = search_metric["column"]
+        operator = search_metric["operator"]
+
+        # q.vector ist der Anfragevektor, q.search_vector seine Darstellung im Raum der durchsuchten Spalte
         query = f"""
-        SELECT id, name, label, embedding
-        FROM track
-        WHERE embedding {operator} '[{vector_str}]' IS NOT NULL
-        AND embedding != '[{vector_str}]'
-        ORDER BY embedding {operator} '[{vector_str}]' LIMIT %s;
+        SELECT q.idx, t.id, t.name, t.label, t.embedding
+        FROM unnest(%s::vector[], %s::vector[]) WITH ORDINALITY AS q(vector, search_vector, idx)
+        CROSS JOIN LATERAL (
+            SELECT id, name, label, embedding, {column} {operator} q.search_vector AS distance
+            FROM track
+            WHERE {column} {operator} q.search_vector IS NOT NULL
+            AND embedding != q.vector
+            ORDER BY {column} {operator} q.search_vector LIMIT %s
+        ) AS t
+        ORDER BY q.idx, t.distance;
         """
 
-        # Query ausführen
-        cursor.execute(query, (self.limit,))
-        results = cursor.fetchall()
+        results = []
+        with self.limits.stage("db"), self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for start in range(0, len(vectors), batch_size):
+                batch = vectors[start:start + batch_size]
+                cursor.execute(query, (
+                    [vector_to_literal(vector) for vector in batch],
+                    [vector_to_literal(prepare_query_vector(self.metric, vector)) for vector in batch],
+                    self.limit
+                ))
+
+                # Zeilen den Eingabevektoren zuordnen (idx beginnt bei 1)
+                grouped = [[] for _ in batch]
+                for row in cursor.fetchall():
+                    grouped[row[0] - 1].append(row[1:])
+                results.extend(rows_to_dicts(rows) for rows in grouped)
+            cursor.close()
+
+        return results
+    
+    def retrieve_context(self, vector) -> list:
+        """
+        Sucht die ähnlichsten Songs zum Vektor und gibt den Kontext für die Generierung zurück,
+        ohne den Vektor über den Anfragetext zu übergeben.
 
-        cursor.close()
-        conn.close()
+        :param vector: Der Anfragevektor (Liste von Zahlen).
+        :return: Im Modus 'tables' eine Liste mit einer Markdown-Tabelle pro Song und der zusammengefassten
+                 Tabelle, im Modus 'compact' eine Liste mit einem Abschnitt im Format CSV.
+        """
+        retrieval = self.retrieve_only(vector)
+        if self.context_mode == "compact":
+            return render_compact_context(retrieval, self.context_tokens, self.model_name)
+        return render_context(retrieval)
 
-        # Ergebnisse in ein Dictionary umwandeln
-        results_dict = [
+    @instrument
+    def retrieve(self, query, vector=None) -> list:
+        """
+        Sucht die ähnlichsten Songs und gibt sie als Markdown-Tabellen für den Kontext zurück.
+
+        :param query: Die Anfrage im Format von vector_to_query.
+        :param vector: Optional der ungerundete Anfragevektor; ohne Angabe wird er aus der Anfrage gelesen.
+        """
+        if vector is None:
+            vector = query_to_vector(query)
+        return self.retrieve_context(vector)
+
+    def _build_messages(self, query, context_str):
+        # Der kompakte Kontext wird als Text eingefügt, die Tabellen wie bisher als Liste
+        if self.context_mode == "compact":
+            context_str = "\n".join(context_str)
+        return [
             {
-                "id": row[0],
-                "name": row[1],
-                "label": row[2],
-                "embedding": row[3]
+                "role": "user", 
+                "content": f"Imagine you are an expert in music, and your goal is to help others decide whether they would like the suggested song based on their preferences for songs they already know and whether they like them or not.\n"
+                f"We have provided context information below:\n"
+                f"{context_str}\n"
+                f"Based on this information, respond to the following question and provide a suggestion on whether the person would probably like or dislike the song:\n"
+                f"{query}\n"
+                f"Label:", 
             }
-            for row in results
         ]
 
-        return results_dict
-    
-    @instrument
-    def retrieve(self, query) -> list:
-
-        vector = query_to_vector(query)
-
-        # Abrufen der Ergebnisse
-        retrieval = self.retrieve_only(vector)
-
-        # Initialisierung für dynamische Spaltenbreiten
-        column_widths = {
-            "Rank": len("Rank"),
-            "Name": len("Name"),
-            "Danceability": len("Danceability"),
-            "Energy": len("Energy"),
-            "Key": len("Key"),
-            "Loudness": len("Loudness"),
-            "Mode": len("Mode"),
-            "Speechiness": len("Speechiness"),
-            "Acousticness": len("Acousticness"),
-            "Instrumentalness": len("Instrumentalness"),
-            "Liveness": len("Liveness"),
-            "Valence": len("Valence"),
-            "Tempo": len("Tempo"),
-            "Duration_ms": len("Duration_ms"),
-            "Time_Signature": len("Time_Signature"),
-            "Label": len("Label")
-        }
-
-        # Aktualisiere die Spaltenbreiten basierend auf den Werten
-        for idx, result in enumerate(retrieval):
-            column_widths["Rank"] = max(column_widths["Rank"], len(str(idx + 1)))
-            column_widths["Name"] = max(column_widths["Name"], len(result["name"]))
-            column_widths["Label"] = max(column_widths["Label"], len(result["label"]))
-
-            embedding_values = result["embedding"]
-            if isinstance(embedding_values, str):
-                embedding_values = eval(embedding_values)  # Konvertiere den String zu einer Liste
-
-            for key, value in zip(["Danceability", "Energy", "Key", "Loudness", "Mode", "Speechiness", "Acousticness", "Instrumentalness", "Liveness", "Valence", "Tempo", "Duration_ms", "Time_Signature"], embedding_values):
-                column_widths[key] = max(column_widths[key], len(f"{round(value, 2)}"))
-
-        # Ergebnisse für die vollständige Tabelle
-        header = " | ".join(f"{key:<{column_widths[key]}}" for key in column_widths.keys())
-        separator = " | ".join("-" * column_widths[key] for key in column_widths.keys())
-
-        markdown_table = f"These are the {len(retrieval)} most similar songs to the request:\n"
-        markdown_table += f"| {header} |\n"
-        markdown_table += f"| {separator} |\n"
-
-        for idx, result in enumerate(retrieval):
-            embedding_values = result["embedding"]
-            if isinstance(embedding_values, str):
-                embedding_values = eval(embedding_values)  # Konvertiere den String zu einer Liste
-
-            # Runde die Werte auf 2 Nachkommastellen und erstelle eine Zeile
-            rounded_values = [round(value, 2) for value in embedding_values]
-            row = [
-                f"{idx + 1:<{column_widths['Rank']}}",
-                f"{result['name']:<{column_widths['Name']}}",
-                *[f"{rounded_values[i]:<{column_widths[col]}}" for i, col in enumerate(["Danceability", "Energy", "Key", "Loudness", "Mode", "Speechiness", "Acousticness", "Instrumentalness", "Liveness", "Valence", "Tempo", "Duration_ms", "Time_Signature"])],
-                f"{result['label']:<{column_widths['Label']}}",
-            ]
-            markdown_table += f"| {' | '.join(row)} |\n"
-
-        # Einzelne Tabellen ohne Rank, angepasst an die berechneten Spaltenbreiten
-        individual_tables = []
-        for idx, result in enumerate(retrieval):
-            embedding_values = result["embedding"]
-            if isinstance(embedding_values, str):
-                embedding_values = eval(embedding_values)  # Konvertiere den String zu einer Liste
-
-            # Runde die Werte auf 2 Nachkommastellen
-            rounded_values = [round(value, 2) for value in embedding_values]
-            
-            # Tabellenheader und Trennlinie mit dynamischen Spaltenbreiten
-            individual_table = f"This is one of the most similar songs to the request:\n"
-            header = " | ".join(f"{key:<{column_widths[key]}}" for key in column_widths.keys() if key != "Rank")
-            separator = " | ".join("-" * column_widths[key] for key in column_widths.keys() if key != "Rank")
-            individual_table += f"| {header} |\n"
-            individual_table += f"| {separator} |\n"
-
-            # Tabellenzeile erstellen
-            row = [
-                f"{result['name']:<{column_widths['Name']}}",
-                *[f"{rounded_values[i]:<{column_widths[col]}}" for i, col in enumerate(["Danceability", "Energy", "Key", "Loudness", "Mode", "Speechiness", "Acousticness", "Instrumentalness", "Liveness", "Valence", "Tempo", "Duration_ms", "Time_Signature"])],
-                f"{result['label']:<{column_widths['Label']}}",
-            ]
-            individual_table += f"| {' | '.join(row)} |\n"
-
-            individual_tables.append(individual_table)
-
-        return individual_tables + [markdown_table]
+    def prompt_tokens(self, query, context_str) -> int:
+        """
+        Anzahl der Tokens der Nachrichten, die generate_completion an das Modell sendet.
+        """
+        if len(context_str) == 0 or self.model_name in KNN_MODELS:
+            return 0
+        return sum(count_tokens(message["content"], self.model_name) for message in self._build_messages(query, context_str))
 
     @instrument
-    def generate_completion(self, query: str, context_str: list) -> str:
+    def generate_completion(self, query: str, context_str: list, vector=None) -> str:
         """
         Generate answer from context.
+
+        Bei den lokalen Modellen 'knn-vote' und 'knn-vote-weighted' wird kein Sprachmodell aufgerufen:
+        die Antwort ist die Mehrheit der Labels der Top-k Tracks aus dem RetrievalMemo.
         """
         if len(context_str) == 0:
             return "Sorry, I couldn't find an answer to your question."
-        
-        if self.model_name in ["gemma2-9b-it","llama-3.1-70b-versatile","llama-3.1-8b-instant",
-                                "llama-3.2-11b-vision-preview","llama-3.2-1b-preview",
-                                "llama-3.2-3b-preview","llama-3.2-90b-vision-preview",
-                                "llama-3.3-70b-specdec","llama-3.3-70b-versatile",
-                                "llama-guard-3-8b","llama3-70b-8192","llama3-8b-8192",
-                                "mixtral-8x7b-32768"]:
-            self.api_url = "https://api.groq.com/openai/v1/chat/completions"
-            self.api_key = os.getenv("GROQ_API_KEY")
-
-            if not self.api_key:
-                raise ValueError("API-Key ist nicht gesetzt. Bitte .env-Datei prüfen.")
-
-            self.headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.api_key}"
-            }
-
-            data = {
-                "model": self.model_name,
-                "messages": [
-                    {
-                        "role": "user", 
-                        "content": f"Imagine you are an expert in music, and your goal is to help others decide whether they would like the suggested song based on their preferences for songs they already know and whether they like them or not.\n"
-                        f"We have provided context information below:\n"
-                        f"{context_str}\n"
-                        f"Based on this information, respond to the following question and provide a suggestion on whether the person would probably like or dislike the song:\n"
-                        f"{query}\n"
-                        f"Label:", 
-                    }
-                ]
-            }
 
-            # Anfrage senden
-            response = requests.post(self.api_url, headers=self.headers, json=data)
-            result = response.json()
-            completion = result["choices"][0]["message"]["content"]
+        if self.model_name in KNN_MODELS:
+            if vector is None:
+                vector = query_to_vector(query)
+            neighbors = self.retrieve_only(vector)
+            return knn_vote(vector, neighbors, self.metric, weighted=self.model_name == "knn-vote-weighted")
+
+        messages = self._build_messages(query, context_str)
+
+        # Antwort aus dem Cache verwenden, falls das Modell diese Nachrichten schon beantwortet hat
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(self.model_name, messages)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
         
-        elif self.model_name in ["gpt-4o","gpt-4o-mini","o1","o1-mini","gpt-3.5-turbo"]:
-            oai_client = OpenAI()
-            completion = (
-                oai_client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    temperature=0,
-                    messages=[
-                        {
-                            "role": "user", 
-                            "content": f"Imagine you are an expert in music, and your goal is to help others decide whether they would like the suggested song based on their preferences for songs they already know and whether they like them or not.\n"
-                            f"We have provided context information below:\n"
-                            f"{context_str}\n"
-                            f"Based on this information, respond to the following question and provide a suggestion on whether the person would probably like or dislike the song:\n"
-                            f"{query}\n"
-                            f"Label:", 
-                        }
-                    ],
-                )
-                .choices[0]
-                .message.content
-            )
+        # Anfrage über den gemeinsamen HTTP-Client senden (Groq und OpenAI)
+        with self.limits.stage("generation"):
+            result = self.llm_client.chat_completion(self.model_name, messages)
+        completion = result["choices"][0]["message"]["content"]
 
         if completion:
+            if cache_key is not None:
+                self.cache.set(cache_key, completion)
             return completion
         else:
             return "Did not find an answer."
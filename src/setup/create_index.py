@@ -0,0 +1,145 @@
+import time
+import threading
+from tqdm import tqdm
+
+from src.utils.connect_db import connect_to_db
+from src.utils.retrieval import SEARCH_METRICS
+
+INDEX_TYPES = ["hnsw", "ivfflat"]
+
+# Operator-Klassen, die IVFFlat nicht unterstützt (L1 gibt es in pgvector nur für HNSW)
+IVFFLAT_UNSUPPORTED = ["vector_l1_ops"]
+
+def index_name(metric, index_type):
+    return f"track_{SEARCH_METRICS[metric]['column']}_{metric}_{index_type}_idx"
+
+def find_vector_index(conn, metric):
+    """
+    Sucht den Vektorindex einer Metrik auf 'track'.
+
+    :return: Ein Tupel (Indextyp, Indexdefinition) oder None, falls kein Index existiert.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = 'track' AND indexname = ANY(%s);",
+        ([index_name(metric, index_type) for index_type in INDEX_TYPES],)
+    )
+    row = cursor.fetchone()
+    cursor.close()
+
+    if row is None:
+        return None
+    index_type = next(index_type for index_type in INDEX_TYPES if row[0] == index_name(metric, index_type))
+    return index_type, row[1]
+
+def default_lists(conn):
+    """
+    Empfohlene Anzahl an IVFFlat-Listen laut pgvector: Zeilen / 1000 bis 1 Mio. Zeilen, darüber sqrt(Zeilen).
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT count(*) FROM track;")
+    rows = cursor.fetchone()[0]
+    cursor.close()
+
+    if rows > 1_000_000:
+        return int(rows ** 0.5)
+    return max(1, rows // 1000)
+
+def _watch_progress(pbar, stop):
+    """
+    Liest den Fortschritt des laufenden Index-Builds aus pg_stat_progress_create_index
+    über eine eigene Verbindung und zeigt ihn im Ladebalken an.
+    """
+    conn = connect_to_db()
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        while not stop.wait(1.0):
+            cursor.execute("""
+            SELECT phase, blocks_done, blocks_total, tuples_done, tuples_total
+            FROM pg_stat_progress_create_index
+            WHERE relid = 'track'::regclass;
+            """)
+            row = cursor.fetchone()
+            if row is None:
+                continue
+            phase, blocks_done, blocks_total, tuples_done, tuples_total = row
+            if tuples_total:
+                done = f"{tuples_done}/{tuples_total} Tupel"
+            elif blocks_total:
+                done = f"{blocks_done}/{blocks_total} Blöcke"
+            else:
+                done = ""
+            pbar.set_postfix_str(f"{phase} {done}".strip())
+    finally:
+        cursor.close()
+        conn.close()
+
+def create_vector_indexes(conn, index_type="hnsw", metrics=None, m=16, ef_construction=64, lists=None, show_progress=True):
+    """
+    Erstellt pgvector-Indizes (HNSW oder IVFFlat) auf 'track' mit der passenden Operator-Klasse je Metrik.
+    Bestehende Indizes gleichen Namens werden ersetzt.
+
+    :param conn: Offene Datenbankverbindung.
+    :param index_type: 'hnsw' oder 'ivfflat'.
+    :param metrics: Liste der Metriken, für die ein Index erstellt wird (Standard: alle).
+    :param m: HNSW-Parameter 'm' (maximale Verbindungen pro Knoten).
+    :param ef_construction: HNSW-Parameter 'ef_construction' (Größe der Kandidatenliste beim Aufbau).
+    :param lists: IVFFlat-Parameter 'lists' (Standard: abhängig von der Tabellengröße).
+    :param show_progress: Ob der Fortschritt des Index-Builds angezeigt wird.
+    :return: Ein Dictionary mit der Dauer in Sekunden je erstelltem Index.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError("Ungültiger Indextyp. Wähle zwischen 'hnsw' oder 'ivfflat'.")
+
+    metrics = metrics or list(SEARCH_METRICS.keys())
+    if index_type == "ivfflat":
+        skipped = [metric for metric in metrics if SEARCH_METRICS[metric]["opclass"] in IVFFLAT_UNSUPPORTED]
+        for metric in skipped:
+            print(f"IVFFlat unterstützt die Metrik '{metric}' nicht, es wird kein Index erstellt.")
+        metrics = [metric for metric in metrics if metric not in skipped]
+    if index_type == "hnsw":
+        options = f"m = {int(m)}, ef_construction = {int(ef_construction)}"
+    else:
+        lists = lists or default_lists(conn)
+        options = f"lists = {int(lists)}"
+
+    durations = {}
+    cursor = conn.cursor()
+    with tqdm(total=len(metrics), desc=f"{index_type.upper()}-Indizes", unit="Index") as pbar:
+        for metric in metrics:
+            name = index_name(metric, index_type)
+            pbar.set_description(f"{index_type.upper()}-Index ({metric})")
+
+            stop = threading.Event()
+            watcher = None
+            if show_progress:
+                watcher = threading.Thread(target=_watch_progress, args=(pbar, stop), daemon=True)
+                watcher.start()
+
+            start = time.perf_counter()
+            try:
+                cursor.execute(f"DROP INDEX IF EXISTS {name};")
+                cursor.execute(f"""
+                CREATE INDEX {name} ON track
+                USING {index_type} ({SEARCH_METRICS[metric]["column"]} {SEARCH_METRICS[metric]["opclass"]})
+                WITH ({options});
+                """)
+                conn.commit()
+                durations[name] = time.perf_counter() - start
+            except Exception as e:
+                conn.rollback()
+                print(f"Fehler beim Erstellen des Index {name}: {e}")
+                continue
+            finally:
+                stop.set()
+                if watcher is not None:
+                    watcher.join()
+                pbar.update(1)
+
+    cursor.close()
+
+    for name, duration in durations.items():
+        print(f"Index {name} in {duration:.2f} s erstellt.")
+
+    return durations
@@ -1,17 +1,29 @@
 # Funktion zum Erstellen der Tabelle
-def create_track_table(conn):
+def create_track_table(conn, incremental=False):
+    """
+    Erstellt die Tabelle 'track'. Ohne incremental wird eine bestehende Tabelle gelöscht und neu
+    erstellt, mit incremental bleiben Tabelle und Indizes erhalten.
+    """
     cursor = conn.cursor()
 
     try:
-        # Tabelle löschen, falls sie existiert, und neu erstellen
+        if not incremental:
+            # Tabelle löschen, falls sie existiert, und neu erstellen
+            cursor.execute("DROP TABLE IF EXISTS track;")
         cursor.execute("""
-        DROP TABLE IF EXISTS track;
-        CREATE TABLE track (
+        CREATE TABLE IF NOT EXISTS track (
             id TEXT PRIMARY KEY,
             name TEXT,
             label TEXT,
-            embedding VECTOR(13) -- 13 ist die Anzahl der Merkmale
+            embedding VECTOR(13), -- 13 ist die Anzahl der Merkmale
+            embedding_whitened VECTOR(13), -- Mit der Kovarianzmatrix geweißt, L2 entspricht Mahalanobis
+            embedding_centered VECTOR(13), -- Zeilenweise zentriert und normiert, Cosinus entspricht Pearson
+            content_hash TEXT -- Hash über Name, Label und Embedding zum Erkennen geänderter Tracks
         );
+        -- Spalten nachrüsten, die in älteren Versionen der Tabelle fehlen (für incremental)
+        ALTER TABLE track ADD COLUMN IF NOT EXISTS embedding_whitened VECTOR(13);
+        ALTER TABLE track ADD COLUMN IF NOT EXISTS embedding_centered VECTOR(13);
+        ALTER TABLE track ADD COLUMN IF NOT EXISTS content_hash TEXT;
         """)
         conn.commit()
     except Exception as e:
@@ -1,41 +1,267 @@
-from psycopg2.extras import execute_values
-import pandas as pd
+import io
+import time
+import hashlib
+import queue
+import struct
+import threading
+import numpy as np
 
-# Daten in die Datenbank schreiben
-def insert_into_pgvector(conn):
-    df = pd.read_csv('src/data/data.csv')
-    data = df.to_dict(orient="records")
+from src.evaluation.similarity.mahalanobis import load_whitening_matrix
+from src.utils.connect_db import connect_to_db
+from src.utils.feature_store import FEATURE_STORE_DIR, load_feature_store
+from src.utils.formatting import VECTOR_COLUMNS
+from src.utils.retrieval import center, whiten
+
+TRACK_COLUMNS = ["id", "name", "label", "embedding", "embedding_whitened", "embedding_centered", "content_hash"]
+
+# Kopf und Ende des binären COPY-Formats von PostgreSQL
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+COPY_TRAILER = struct.pack("!h", -1)
+
+def _text_field(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return struct.pack("!i", -1)
+    encoded = str(value).encode("utf-8")
+    return struct.pack("!i", len(encoded)) + encoded
+
+def _vector_fields(vectors):
+    """
+    Kodiert die Zeilen einer Matrix im Binärformat von pgvector: int16 Dimension, int16 unbenutzt,
+    danach die Werte als float4 (Big Endian), jeweils mit vorangestellter Feldlänge.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=">f4")
+    dimension = vectors.shape[1]
+    prefix = struct.pack("!ihh", 4 + 4 * dimension, dimension, 0)
+    return [prefix + row.tobytes() for row in vectors]
+
+def whitening_hash(whitening):
+    """
+    Hash über die Whitening-Matrix. Er geht in content_hash ein, da sich mit einer neuen
+    Kovarianzmatrix die geweißten Embeddings aller Tracks ändern.
+    """
+    return hashlib.sha1(np.ascontiguousarray(whitening, dtype=">f8").tobytes()).hexdigest()
+
+def content_hash(name, label, embedding, whitening_digest=""):
+    """
+    Hash über Name, Label, Embedding (float32 wie in pgvector) und die Whitening-Matrix (siehe
+    whitening_hash), um geänderte Tracks zu erkennen.
+    """
+    digest = hashlib.sha1()
+    digest.update(f"{name}\x1f{label}\x1f{whitening_digest}\x1f".encode("utf-8"))
+    digest.update(np.asarray(embedding, dtype=">f4").tobytes())
+    return digest.hexdigest()
 
+def encode_copy_chunk(df, whitening):
+    """
+    Wandelt einen Teil der Daten in einen binären COPY-Datenstrom für die Spalten TRACK_COLUMNS um.
+    Die geweißten (Mahalanobis) und zentrierten (Pearson) Embeddings werden dabei mitberechnet.
+
+    :param df: Ein Teil der Daten aus dem Feature Store.
+    :param whitening: Die Whitening-Matrix zur Kovarianzmatrix desselben Feature Stores.
+    """
+    embeddings = df[VECTOR_COLUMNS].to_numpy(dtype=np.float64)
+    whitening_digest = whitening_hash(whitening)
+    vector_fields = zip(
+        _vector_fields(embeddings),
+        _vector_fields(whiten(embeddings, whitening)),
+        _vector_fields(center(embeddings)),
+    )
+
+    buffer = io.BytesIO()
+    buffer.write(COPY_HEADER)
+    field_count = struct.pack("!h", len(TRACK_COLUMNS))
+    for track_id, name, label, embedding, vectors in zip(df["ID"], df["Name"], df["Label"], embeddings, vector_fields):
+        buffer.write(field_count)
+        buffer.write(_text_field(track_id))
+        buffer.write(_text_field(name))
+        buffer.write(_text_field(label))
+        buffer.write(b"".join(vectors))
+        buffer.write(_text_field(content_hash(name, label, embedding, whitening_digest)))
+    buffer.write(COPY_TRAILER)
+    buffer.seek(0)
+    return buffer
+
+def _copy_worker(conn, chunks, errors, whitening):
+    """
+    Lädt Teile der Daten aus der Warteschlange per COPY in die Staging-Tabelle.
+    """
+    cursor = conn.cursor()
+    done = False
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                done = True
+                break
+            if errors:
+                continue
+            cursor.copy_expert(
+                f"COPY track_staging ({', '.join(TRACK_COLUMNS)}) FROM STDIN WITH (FORMAT binary);",
+                encode_copy_chunk(chunk, whitening)
+            )
+            conn.commit()
+    except Exception as e:
+        conn.rollback()
+        errors.append(e)
+        # Warteschlange leeren, damit der Leser nicht blockiert
+        while not done and chunks.get() is not None:
+            pass
+    finally:
+        cursor.close()
+
+def fetch_track_hashes(conn):
+    """
+    Liest den content_hash aller Tracks in 'track'. Tracks, bei denen eine abgeleitete Vektorspalte
+    fehlt (NULL, z.B. nach dem Nachrüsten der Spalte), erhalten None und gelten damit als geändert.
+
+    :return: Ein Dictionary {ID: content_hash}.
+    """
     cursor = conn.cursor()
+    try:
+        cursor.execute("""
+        SELECT id, CASE WHEN embedding_whitened IS NULL OR embedding_centered IS NULL THEN NULL ELSE content_hash END
+        FROM track;
+        """)
+        return dict(cursor.fetchall())
+    finally:
+        cursor.close()
 
-    # SQL-Befehl zum Einfügen der Daten
-    insert_query = """
-    INSERT INTO track (id, name, label, embedding)
-    VALUES %s
-    ON CONFLICT (id) DO NOTHING;
-    """
-
-    # Daten für den Insert vorbereiten
-    values = []
-    for record in data:
-        embedding = [
-            record["Danceability"],
-            record["Energy"],
-            record["Key"],
-            record["Loudness"],
-            record["Mode"],
-            record["Speechiness"],
-            record["Acousticness"],
-            record["Instrumentalness"],
-            record["Liveness"],
-            record["Valence"],
-            record["Tempo"],
-            record["Duration_ms"],
-            record["Time_Signature"]
-        ]
-        values.append((record["ID"], record["Name"], record["Label"], embedding))
-
-    # Daten einfügen
-    execute_values(cursor, insert_query, values)
+def _changed_rows(chunk, known_hashes, whitening_digest):
+    # Nur Tracks, die neu sind oder deren Hash sich gegenüber der Tabelle geändert hat
+    embeddings = chunk[VECTOR_COLUMNS].to_numpy(dtype=np.float64)
+    changed = [
+        known_hashes.get(track_id) != content_hash(name, label, embedding, whitening_digest)
+        for track_id, name, label, embedding in zip(chunk["ID"], chunk["Name"], chunk["Label"], embeddings)
+    ]
+    return chunk[changed]
+
+def load_staging_table(conn, feature_store=FEATURE_STORE_DIR, chunk_size=50_000, workers=1, known_hashes=None):
+    """
+    Lädt die Tracks in Teilen per binärem COPY in die (ungeloggte) Staging-Tabelle 'track_staging'.
+    Mit mehreren Workern werden die Teile des Feature Stores parallel über eigene Verbindungen geladen.
+
+    :param known_hashes: Optional die Hashes der Tracks in 'track' (siehe fetch_track_hashes). Dann werden
+                         nur neue und geänderte Tracks geladen, statt den ganzen Katalog zu kopieren.
+    :return: Die Anzahl der gelesenen und die Anzahl der geladenen Zeilen.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+    DROP TABLE IF EXISTS track_staging;
+    CREATE UNLOGGED TABLE track_staging (LIKE track INCLUDING DEFAULTS);
+    """)
     conn.commit()
     cursor.close()
+
+    # Geweißt wird mit der Kovarianzmatrix des geladenen Feature Stores, nicht mit der des Standard-Stores
+    whitening = load_whitening_matrix(feature_store)
+    connections = [conn] + [connect_to_db() for _ in range(workers - 1)]
+    chunks = queue.Queue(maxsize=2 * workers)
+    errors = []
+    threads = [threading.Thread(target=_copy_worker, args=(worker_conn, chunks, errors, whitening)) for worker_conn in connections]
+    for thread in threads:
+        thread.start()
+
+    whitening_digest = whitening_hash(whitening)
+    rows = 0
+    staged = 0
+    try:
+        for chunk in load_feature_store(feature_store).iter_frames(chunk_size):
+            rows += len(chunk)
+            if known_hashes is not None:
+                chunk = _changed_rows(chunk, known_hashes, whitening_digest)
+                if chunk.empty:
+                    continue
+            staged += len(chunk)
+            chunks.put(chunk)
+    except BaseException as e:
+        errors.append(e)
+    finally:
+        for _ in threads:
+            chunks.put(None)
+        for thread in threads:
+            thread.join()
+        for worker_conn in connections[1:]:
+            worker_conn.close()
+
+    if errors:
+        raise errors[0]
+    return rows, staged
+
+def merge_staging_table(conn, incremental=False, removed_ids=()):
+    """
+    Überträgt die Staging-Tabelle in 'track' und löscht sie anschließend.
+
+    Ohne incremental ist 'track' neu erstellt und die Tracks werden eingefügt. Mit incremental enthält
+    die Staging-Tabelle nur neue und geänderte Tracks (siehe load_staging_table): neue werden eingefügt,
+    bestehende aktualisiert und die Tracks aus removed_ids gelöscht. Fehlende (NULL) geweißte bzw.
+    zentrierte Embeddings gelten dabei als Änderung und werden so auch für sonst unveränderte Tracks ergänzt.
+
+    :param removed_ids: Die IDs der Tracks, die nicht mehr im Feature Store enthalten sind.
+    :return: Ein Dictionary mit der Anzahl eingefügter, aktualisierter und gelöschter Tracks.
+    """
+    columns = ", ".join(TRACK_COLUMNS)
+    changes = {"inserted": 0, "updated": 0, "deleted": 0}
+    cursor = conn.cursor()
+    try:
+        cursor.execute("CREATE INDEX ON track_staging (id); ANALYZE track_staging;")
+
+        if incremental:
+            if removed_ids:
+                cursor.execute("DELETE FROM track WHERE id = ANY(%s);", (list(removed_ids),))
+                changes["deleted"] = cursor.rowcount
+
+            assignments = ", ".join(f"{column} = s.{column}" for column in TRACK_COLUMNS if column != "id")
+            cursor.execute(f"""
+            UPDATE track t SET {assignments}
+            FROM (SELECT DISTINCT ON (id) {columns} FROM track_staging) s
+            WHERE t.id = s.id
+            AND (t.content_hash IS DISTINCT FROM s.content_hash
+                 OR t.embedding_whitened IS DISTINCT FROM s.embedding_whitened
+                 OR t.embedding_centered IS DISTINCT FROM s.embedding_centered);
+            """)
+            changes["updated"] = cursor.rowcount
+
+        cursor.execute(f"""
+        INSERT INTO track ({columns})
+        SELECT DISTINCT ON (id) {columns} FROM track_staging
+        ON CONFLICT (id) DO NOTHING;
+        """)
+        changes["inserted"] = cursor.rowcount
+
+        cursor.execute("DROP TABLE track_staging;")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return changes
+
+# Daten in die Datenbank schreiben
+def insert_into_pgvector(conn, feature_store=FEATURE_STORE_DIR, chunk_size=50_000, workers=1, incremental=False):
+    """
+    Lädt die Tracks per binärem COPY in eine Staging-Tabelle und überträgt sie von dort in 'track'.
+
+    :param conn: Offene Datenbankverbindung (wird vom ersten Worker verwendet).
+    :param feature_store: Verzeichnis des Feature Stores mit den vorverarbeiteten Daten.
+    :param chunk_size: Anzahl der Zeilen pro COPY.
+    :param workers: Anzahl paralleler Verbindungen.
+    :param incremental: Ob nur die Änderungen gegenüber dem Tabelleninhalt übernommen werden (siehe merge_staging_table).
+    :return: Ein Dictionary mit der Anzahl eingefügter, aktualisierter und gelöschter Tracks.
+    """
+    known_hashes = None
+    removed_ids = ()
+    if incremental:
+        # Abgleich über (ID, content_hash) auf dem Client, geladen werden nur neue und geänderte Tracks
+        known_hashes = fetch_track_hashes(conn)
+        removed_ids = known_hashes.keys() - set(load_feature_store(feature_store).ids)
+
+    start = time.perf_counter()
+    rows, staged = load_staging_table(conn, feature_store=feature_store, chunk_size=chunk_size, workers=workers,
+                                      known_hashes=known_hashes)
+    duration = time.perf_counter() - start
+    print(f"{rows} Zeilen gelesen, {staged} in {duration:.2f} s geladen ({rows / max(duration, 1e-9):.0f} Zeilen/s).")
+
+    changes = merge_staging_table(conn, incremental=incremental, removed_ids=removed_ids)
+    print(f"{changes['inserted']} Tracks eingefügt, {changes['updated']} aktualisiert, {changes['deleted']} gelöscht.")
+    return changes
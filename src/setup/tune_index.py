@@ -0,0 +1,198 @@
+import os
+import re
+import json
+import time
+import psycopg2
+from tqdm import tqdm
+
+from src.setup.create_index import find_vector_index
+from src.utils.feature_store import load_feature_store
+from src.utils.formatting import VECTOR_COLUMNS
+from src.utils.retrieval import build_search_query
+
+SEARCH_PARAMS_FILE = "src/data/preprocessed/search_params.json"
+
+# Suchparameter von pgvector je Indextyp
+SEARCH_SETTINGS = {
+    "hnsw": "hnsw.ef_search",
+    "ivfflat": "ivfflat.probes",
+}
+
+def load_search_params(path=SEARCH_PARAMS_FILE):
+    """
+    Lädt die gespeicherten Suchparameter je Metrik (leer, falls noch nicht getunt).
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+# Standardwerte von pgvector, falls der Index nicht getunt wurde
+DEFAULT_SEARCH_VALUES = {
+    "hnsw": 40,
+    "ivfflat": 1,
+}
+
+# Obergrenze von hnsw.ef_search in pgvector
+MAX_EF_SEARCH = 1000
+
+# Bereits ausgegebene Hinweise, damit sie nicht für jede Session des Pools erscheinen
+_hints = set()
+
+def _hint(message):
+    if message not in _hints:
+        _hints.add(message)
+        print(message)
+
+def search_setting(metric, path=SEARCH_PARAMS_FILE):
+    """
+    Gibt den getunten Suchparameter einer Metrik als (Name, Wert) zurück oder None.
+    """
+    params = load_search_params(path).get(metric)
+    if params is None:
+        return None
+    return params["setting"], params["value"]
+
+def session_settings(conn, metric, limit, path=SEARCH_PARAMS_FILE):
+    """
+    Bestimmt die Suchparameter einer Session für die Suche der Top-limit Tracks einer Metrik.
+
+    Bei HNSW ist ef_search die Größe der Kandidatenliste: ist sie kleiner als limit + 1 (ein
+    identisches Embedding wird nach dem Indexscan herausgefiltert), liefert der Index zu wenige
+    Nachbarn. Daher wird ef_search mindestens auf limit + 1 gesetzt und zusätzlich der iterative
+    Scan von pgvector aktiviert, der weitersucht, falls der Filter Zeilen entfernt. Bei IVFFlat
+    können die durchsuchten Listen nach dem Filter ebenfalls zu wenige Tracks enthalten, dort wird
+    der iterative Scan mit relaxed_order aktiviert (nur diese Variante unterstützt IVFFlat; erst
+    Treffer aus weiteren Listen können leicht von der Sortierung abweichen).
+
+    :param conn: Offene Datenbankverbindung.
+    :param metric: Die Metrik der Similarity Search.
+    :param limit: Die Anzahl der gesuchten Ergebnisse.
+    :return: Eine Liste von Tupeln (Name, Wert), leer, falls kein Index existiert.
+    """
+    index = find_vector_index(conn, metric)
+    if index is None:
+        return []
+    index_type = index[0]
+
+    params = load_search_params(path).get(metric)
+    if params is not None and params.get("index_type") != index_type:
+        # Getunt für einen anderen Indextyp, der Wert ist nicht übertragbar
+        params = None
+    value = params["value"] if params is not None else DEFAULT_SEARCH_VALUES[index_type]
+    if params is not None and params.get("top_k", 0) < limit:
+        _hint(f"Hinweis: {params['setting']} wurde für Top-{params.get('top_k')} getunt, gesucht wird Top-{limit}. "
+              f"Für den Ziel-Recall bitte 'python run.py tune --similarity-search {metric.replace('_', '-')} --top-k {limit}' ausführen.")
+
+    if index_type == "hnsw":
+        if limit + 1 > MAX_EF_SEARCH:
+            _hint(f"Hinweis: hnsw.ef_search ist auf {MAX_EF_SEARCH} begrenzt, der iterative Scan ergänzt fehlende Nachbarn.")
+        return [
+            ("hnsw.ef_search", min(max(value, limit + 1), MAX_EF_SEARCH)),
+            ("hnsw.iterative_scan", "strict_order"),
+        ]
+    return [
+        (SEARCH_SETTINGS[index_type], value),
+        ("ivfflat.iterative_scan", "relaxed_order"),
+    ]
+
+def apply_session_settings(conn, settings):
+    """
+    Setzt Suchparameter für die Session. Parameter, die die installierte pgvector-Version nicht
+    kennt (z.B. hnsw.iterative_scan bzw. ivfflat.iterative_scan vor 0.8.0), werden übersprungen.
+    """
+    cursor = conn.cursor()
+    try:
+        for setting, value in settings:
+            cursor.execute("SAVEPOINT search_setting;")
+            try:
+                cursor.execute(f"SET {setting} = %s;", (value,))
+            except psycopg2.Error:
+                cursor.execute("ROLLBACK TO SAVEPOINT search_setting;")
+            cursor.execute("RELEASE SAVEPOINT search_setting;")
+    finally:
+        cursor.close()
+
+def _candidates(index_type, top_k, indexdef):
+    if index_type == "hnsw":
+        # ef_search muss mindestens top_k + 1 sein (wie in session_settings), pgvector erlaubt maximal 1000
+        values = [min(max(top_k + 1, value), MAX_EF_SEARCH) for value in [10, 20, 40, 80, 160, 320, 640, 1000]]
+    else:
+        match = re.search(r"lists\s*=\s*'?(\d+)", indexdef)
+        lists = int(match.group(1)) if match else 100
+        values = [2 ** i for i in range(lists.bit_length()) if 2 ** i < lists] + [lists]
+    return sorted(set(values))
+
+def _search(cursor, metric, vectors, top_k):
+    results = []
+    for vector in vectors:
+        cursor.execute(build_search_query(metric, vector, include_identical=False), (top_k,))
+        results.append({row[0] for row in cursor.fetchall()})
+    return results
+
+def tune_search_params(conn, metric, top_k=10, target_recall=0.95, sample_size=100, path=SEARCH_PARAMS_FILE):
+    """
+    Bestimmt den kleinsten Suchparameter (hnsw.ef_search bzw. ivfflat.probes), der für eine
+    Stichprobe von Anfragevektoren mindestens den Ziel-Recall@k gegenüber der exakten Suche erreicht,
+    und speichert ihn in 'path'.
+
+    :param conn: Offene Datenbankverbindung.
+    :param metric: Die Metrik, deren Index getunt wird.
+    :param top_k: Anzahl der Ergebnisse, für die der Recall gemessen wird.
+    :param target_recall: Ziel-Recall@k zwischen 0 und 1.
+    :param sample_size: Anzahl der Anfragevektoren aus dem Feature Store.
+    :return: Ein Dictionary mit Parameter, Wert, Recall und mittlerer Latenz.
+    """
+    index = find_vector_index(conn, metric)
+    if index is None:
+        raise ValueError(f"Kein Vektorindex für die Metrik '{metric}' gefunden. Bitte zuerst 'python run.py setup' ausführen.")
+    index_type, indexdef = index
+    setting = SEARCH_SETTINGS[index_type]
+
+    data = load_feature_store().frame()
+    data = data.sample(min(sample_size, len(data)), random_state=1)
+    vectors = data[VECTOR_COLUMNS].values.tolist()
+
+    cursor = conn.cursor()
+
+    # Exakte Suche als Referenz: Indexscans nur für diese Transaktion deaktivieren
+    cursor.execute("SET LOCAL enable_indexscan = off;")
+    exact = _search(cursor, metric, vectors, top_k)
+    conn.rollback()
+
+    best = None
+    for value in tqdm(_candidates(index_type, top_k, indexdef), desc=f"Tuning {setting}", unit="Wert"):
+        cursor.execute(f"SET LOCAL {setting} = %s;", (value,))
+        start = time.perf_counter()
+        approximate = _search(cursor, metric, vectors, top_k)
+        latency_ms = (time.perf_counter() - start) / len(vectors) * 1000
+        conn.rollback()
+
+        recall = sum(
+            len(found & expected) / len(expected) if expected else 1.0
+            for found, expected in zip(approximate, exact)
+        ) / len(vectors)
+
+        best = {
+            "index_type": index_type,
+            "setting": setting,
+            "value": value,
+            "recall": recall,
+            "latency_ms": latency_ms,
+            "top_k": top_k,
+        }
+        if recall >= target_recall:
+            break
+    else:
+        print(f"Ziel-Recall {target_recall} wurde nicht erreicht, verwende den größten getesteten Wert.")
+
+    cursor.close()
+
+    params = load_search_params(path)
+    params[metric] = best
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(params, file, indent=4)
+
+    print(f"{setting} = {best['value']} (Recall@{top_k}: {best['recall']:.3f}, "
+          f"Latenz: {best['latency_ms']:.2f} ms pro Anfrage) in {path} gespeichert.")
+    return best
@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+CACHE_MODES = ["read-write", "read-only", "off"]
+
+class DiskCache:
+    """
+    Persistenter Key-Value-Cache auf Basis von SQLite, z.B. für Antworten von Sprachmodellen.
+
+    Einträge werden nach Alter (max_age_days) und Anzahl (max_entries, am längsten nicht
+    genutzte zuerst) verdrängt. Treffer und Fehlschläge werden gezählt.
+
+    :param path: Pfad zur SQLite-Datei.
+    :param mode: 'read-write' (lesen und schreiben), 'read-only' (nur lesen) oder 'off' (deaktiviert).
+    :param max_entries: Maximale Anzahl an Einträgen.
+    :param max_age_days: Maximales Alter eines Eintrags in Tagen (None für unbegrenzt).
+    """
+
+    # Verdrängung nur alle n Schreibvorgänge prüfen
+    EVICTION_INTERVAL = 100
+
+    def __init__(self, path, mode="read-write", max_entries=100_000, max_age_days=30):
+        if mode not in CACHE_MODES:
+            raise ValueError("Ungültiger Cache-Modus. Wähle zwischen 'read-write', 'read-only' oder 'off'.")
+
+        self.path = path
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 86400 if max_age_days is not None else None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+        if mode == "read-write":
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL;")
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                created_at REAL,
+                accessed_at REAL
+            );
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);")
+            self._conn.commit()
+        elif mode == "read-only" and os.path.exists(path):
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        Erstellt einen stabilen Schlüssel aus beliebigen JSON-serialisierbaren Bestandteilen.
+        """
+        payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _expired(self, created_at, now):
+        return self.max_age_seconds is not None and now - created_at > self.max_age_seconds
+
+    def get(self, key):
+        """
+        Gibt den gespeicherten Wert zurück oder None, falls kein (gültiger) Eintrag existiert.
+        """
+        if self.mode == "off":
+            return None
+
+        with self._lock:
+            row = None
+            if self._conn is not None:
+                try:
+                    row = self._conn.execute("SELECT value, created_at FROM entries WHERE key = ?;", (key,)).fetchone()
+                except sqlite3.OperationalError:
+                    row = None
+
+            now = time.time()
+            if row is None or self._expired(row[1], now):
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            if self.mode == "read-write":
+                self._conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?;", (now, key))
+                self._conn.commit()
+            return json.loads(row[0])
+
+    def set(self, key, value):
+        """
+        Speichert einen JSON-serialisierbaren Wert (nur im Modus 'read-write').
+        """
+        if self.mode != "read-write":
+            return
+
+        with self._lock:
+            now = time.time()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?);",
+                (key, json.dumps(value, ensure_ascii=False, default=str), now, now)
+            )
+            self.writes += 1
+            if self.writes % self.EVICTION_INTERVAL == 0:
+                self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        if self.max_age_seconds is not None:
+            self._conn.execute("DELETE FROM entries WHERE created_at < ?;", (now - self.max_age_seconds,))
+        self._conn.execute("""
+        DELETE FROM entries WHERE key IN (
+            SELECT key FROM entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+        );
+        """, (self.max_entries,))
+
+    def stats(self):
+        """
+        Gibt Treffer, Fehlschläge, Schreibvorgänge und die Anzahl gespeicherter Einträge zurück.
+        """
+        entries = 0
+        if self._conn is not None:
+            with self._lock:
+                try:
+                    entries = self._conn.execute("SELECT count(*) FROM entries;").fetchone()[0]
+                except sqlite3.OperationalError:
+                    entries = 0
+        return {"hits": self.hits, "misses": self.misses, "writes": self.writes, "entries": entries}
+
+    def close(self):
+        """
+        Führt eine letzte Verdrängung aus und schließt die Datenbank.
+        """
+        if self._conn is None:
+            return
+        with self._lock:
+            if self.mode == "read-write":
+                self._evict(time.time())
+                self._conn.commit()
+            self._conn.close()
+            self._conn = None
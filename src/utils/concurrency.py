@@ -0,0 +1,22 @@
+import threading
+from contextlib import nullcontext
+
+class StageLimits:
+    """
+    Begrenzt die Anzahl gleichzeitiger Aufrufe je Verarbeitungsstufe (z.B. 'db', 'generation',
+    'evaluation'), damit parallel laufende Tracks die Datenbank und die Modell-Provider nicht überlasten.
+
+    :param limits: Maximale Anzahl gleichzeitiger Aufrufe je Stufe, z.B. StageLimits(db=4, generation=8).
+                   Stufen ohne Angabe (oder mit None) sind unbegrenzt.
+    """
+
+    def __init__(self, **limits):
+        self.limits = {name: limit for name, limit in limits.items() if limit is not None}
+        self._semaphores = {name: threading.BoundedSemaphore(limit) for name, limit in self.limits.items()}
+
+    def stage(self, name):
+        """
+        Gibt einen Kontextmanager zurück, der einen Platz in der Stufe 'name' belegt.
+        """
+        semaphore = self._semaphores.get(name)
+        return semaphore if semaphore is not None else nullcontext()
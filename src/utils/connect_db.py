@@ -1,12 +1,182 @@
 import os
+import weakref
+import threading
+from contextlib import contextmanager
 import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import ThreadedConnectionPool
+
+# Verbindungsparameter aus der .env-Datei
+def connection_params():
+    return {
+        "dbname": os.getenv("DB_NAME"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "host": os.getenv("DB_HOST"),
+        "port": os.getenv("DB_PORT"),
+    }
 
 # Verbindung zu PostgreSQL herstellen
 def connect_to_db():
-    return psycopg2.connect(
-        dbname=os.getenv("DB_NAME"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        host=os.getenv("DB_HOST"),
-        port=os.getenv("DB_PORT")
-    )
\ No newline at end of file
+    return psycopg2.connect(**connection_params())
+
+def _pool_size(name, default):
+    return int(os.getenv(name, default))
+
+class ConnectionPool:
+    """
+    Thread-sicherer Pool wiederverwendbarer PostgreSQL-Verbindungen.
+
+    Die Verbindungen werden erst beim ersten Zugriff aufgebaut. Sind alle max_size Verbindungen
+    vergeben, wartet der Aufrufer, bis eine zurückgelegt wird. Vor jeder Ausgabe wird optional
+    geprüft, ob die Verbindung noch lebt; defekte Verbindungen werden verworfen und ersetzt.
+
+    :param min_size: Anzahl der Verbindungen, die offen gehalten werden (Standard: DB_POOL_MIN_SIZE oder 1,
+                     höchstens max_size).
+    :param max_size: Maximale Anzahl gleichzeitiger Verbindungen (Standard: DB_POOL_MAX_SIZE oder 5).
+    :param health_check: Ob Verbindungen vor der Ausgabe mit 'SELECT 1' geprüft werden.
+    :param configure: Optionale Funktion, die einmal pro neuer Verbindung (Session) ausgeführt wird.
+    """
+
+    def __init__(self, min_size=None, max_size=None, health_check=True, configure=None):
+        self.max_size = max_size if max_size is not None else _pool_size("DB_POOL_MAX_SIZE", 5)
+        # Ein kleineres max_size (z.B. über --db-concurrency) begrenzt auch DB_POOL_MIN_SIZE
+        self.min_size = min(min_size if min_size is not None else _pool_size("DB_POOL_MIN_SIZE", 1), self.max_size)
+        self.health_check = health_check
+        self.configure = configure
+        self._pool = None
+        self._lock = threading.Lock()
+        # ThreadedConnectionPool wirft bei erschöpftem Pool einen PoolError, daher wird vorher gewartet
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._configured = weakref.WeakSet()
+        # Pool, aus dem eine ausgegebene Verbindung stammt (nach close() wird ein neuer Pool erstellt)
+        self._owners = weakref.WeakKeyDictionary()
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadedConnectionPool(self.min_size, self.max_size, **connection_params())
+        return self._pool
+
+    @staticmethod
+    def _is_healthy(conn):
+        if conn.closed:
+            return False
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1;")
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _healthy_connection(self, pool):
+        # Defekte Verbindungen schließen und ersetzen, bis eine funktionierende gefunden ist;
+        # nach max_size + 1 Versuchen sind alle vorhandenen und eine neue Verbindung defekt
+        for _ in range(self.max_size + 1):
+            conn = pool.getconn()
+            if not self.health_check or self._is_healthy(conn):
+                return conn
+            pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError("Keine funktionierende Datenbankverbindung im Pool verfügbar.")
+
+    def _checkout(self):
+        self._slots.acquire()
+        try:
+            pool = self._get_pool()
+            conn = self._healthy_connection(pool)
+            try:
+                if self.configure is not None and conn not in self._configured:
+                    self.configure(conn)
+                    conn.commit()
+                    self._configured.add(conn)
+            except BaseException:
+                pool.putconn(conn, close=True)
+                raise
+            self._owners[conn] = pool
+            return conn
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _checkin(self, conn):
+        try:
+            if not conn.closed and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+            with self._lock:
+                owner = self._owners.pop(conn, None)
+                if self._pool is None or owner is not self._pool:
+                    # Der Pool wurde zwischenzeitlich geschlossen, die Verbindung wird direkt geschlossen
+                    conn.close()
+                else:
+                    self._pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Gibt eine Verbindung aus dem Pool aus und legt sie danach zurück. Ist der Pool erschöpft,
+        wird gewartet. Offene Transaktionen werden beim Zurücklegen zurückgerollt.
+        """
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            self._checkin(conn)
+
+    def close(self):
+        """
+        Schließt alle Verbindungen des Pools.
+        """
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Gibt den prozessweit geteilten Pool zurück (wird beim ersten Aufruf erzeugt).
+    """
+    global _default_pool
+    if _default_pool is None:
+        with _default_pool_lock:
+            if _default_pool is None:
+                _default_pool = ConnectionPool()
+    return _default_pool
+
+async def create_async_pool(min_size=None, max_size=None, health_check=True, configure=None):
+    """
+    Erstellt einen asynchronen Verbindungspool auf Basis von psycopg 3 (psycopg_pool).
+
+    :param min_size: Anzahl der Verbindungen, die offen gehalten werden (Standard: DB_POOL_MIN_SIZE oder 1,
+                     höchstens max_size).
+    :param max_size: Maximale Anzahl gleichzeitiger Verbindungen (Standard: DB_POOL_MAX_SIZE oder 5).
+    :param health_check: Ob Verbindungen vor der Ausgabe geprüft werden.
+    :param configure: Optionale async-Funktion, die einmal pro neuer Verbindung ausgeführt wird.
+    :return: Ein geöffneter psycopg_pool.AsyncConnectionPool.
+    """
+    try:
+        from psycopg_pool import AsyncConnectionPool
+    except ImportError as e:
+        raise ImportError("Für den asynchronen Pool wird 'psycopg[pool]' benötigt.") from e
+
+    params = {key: value for key, value in connection_params().items() if value is not None}
+    pool = AsyncConnectionPool(
+        kwargs=params,
+        min_size=min_size if min_size is not None else _pool_size("DB_POOL_MIN_SIZE", 1),
+        max_size=max_size if max_size is not None else _pool_size("DB_POOL_MAX_SIZE", 5),
+        check=AsyncConnectionPool.check_connection if health_check else None,
+        configure=configure,
+        open=False,
+    )
+    await pool.open()
+    return pool
@@ -0,0 +1,138 @@
+import io
+import csv
+import json
+import math
+from functools import lru_cache
+
+from src.utils.formatting import VECTOR_COLUMNS
+
+# Spalten der Kontext-Tabellen, die Einzeltabellen enthalten alle außer 'Rank'
+CONTEXT_COLUMNS = ["Rank", "Name", *VECTOR_COLUMNS, "Label"]
+
+COMBINED_TITLE = "These are the {} most similar songs to the request:\n"
+INDIVIDUAL_TITLE = "This is one of the most similar songs to the request:\n"
+COMPACT_TITLE = "These are the {} most similar songs to the request, ordered by similarity:\n"
+
+# 'tables': eine Markdown-Tabelle pro Song und eine zusammengefasste Tabelle
+# 'compact': alle Songs als CSV-Zeilen in einem Abschnitt, optional auf ein Token-Budget gekürzt
+CONTEXT_MODES = ["tables", "compact"]
+
+@lru_cache(maxsize=None)
+def _encoding(model_name):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except Exception:
+        pass
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # z.B. ohne Netzwerkzugriff für den Download der Kodierung
+        return None
+
+def count_tokens(text, model_name=None):
+    """
+    Zählt die Tokens eines Texts mit tiktoken, falls installiert. Für unbekannte Modelle (z.B. Groq)
+    wird die Kodierung cl100k_base verwendet, ohne tiktoken eine Schätzung mit 4 Zeichen pro Token.
+    """
+    encoding = _encoding(model_name)
+    if encoding is None:
+        return math.ceil(len(text) / 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def parse_embedding(embedding):
+    """
+    Wandelt ein Embedding im Textformat von pgvector (z.B. '[0.1,0.2,1]') in eine Liste um.
+    Wie bei eval bleiben ganze Zahlen int, damit die Darstellung im Kontext unverändert bleibt.
+    """
+    if isinstance(embedding, str):
+        return json.loads(embedding)
+    return list(embedding)
+
+@lru_cache(maxsize=256)
+def _row_template(widths):
+    # Zeilenvorlage einer Markdown-Tabelle, wird pro Kombination von Spaltenbreiten nur einmal erstellt
+    return "| " + " | ".join(f"{{{index}:<{width}}}" for index, width in enumerate(widths)) + " |\n"
+
+def _separator(widths):
+    return "| " + " | ".join("-" * width for width in widths) + " |\n"
+
+def context_rows(retrieval):
+    """
+    Bereitet die Suchergebnisse als Tabellenzeilen (Rank, Name, Merkmale auf 2 Nachkommastellen, Label) auf.
+    Jedes Embedding wird dabei genau einmal gelesen.
+    """
+    return [
+        [f"{rank}", result["name"], *[f"{round(value, 2)}" for value in parse_embedding(result["embedding"])[:len(VECTOR_COLUMNS)]], result["label"]]
+        for rank, result in enumerate(retrieval, start=1)
+    ]
+
+def render_context(retrieval):
+    """
+    Erstellt den Kontext für die Generierung: eine Tabelle pro Song (ohne Rank) und am Ende eine
+    Tabelle mit allen Songs. Die Spaltenbreiten richten sich nach dem längsten Wert je Spalte.
+
+    :param retrieval: Die Ergebnisse von RAG.retrieve_only.
+    :return: Eine Liste mit den Einzeltabellen und der zusammengefassten Tabelle.
+    """
+    rows = context_rows(retrieval)
+    widths = tuple(
+        max([len(column)] + [len(row[index]) for row in rows])
+        for index, column in enumerate(CONTEXT_COLUMNS)
+    )
+
+    row_template = _row_template(widths)
+    individual_template = _row_template(widths[1:])
+    individual_head = INDIVIDUAL_TITLE + individual_template.format(*CONTEXT_COLUMNS[1:]) + _separator(widths[1:])
+
+    combined = [COMBINED_TITLE.format(len(rows)), row_template.format(*CONTEXT_COLUMNS), _separator(widths)]
+    individual_tables = []
+    for row in rows:
+        combined.append(row_template.format(*row))
+        individual_tables.append(individual_head + individual_template.format(*row[1:]))
+
+    return individual_tables + ["".join(combined)]
+
+def _csv_line(values):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerow(values)
+    return buffer.getvalue()
+
+def render_compact_context(retrieval, max_tokens=None, model_name=None):
+    """
+    Erstellt den Kontext als einen Abschnitt mit einer CSV-Zeile pro Song (Werte auf 2 Nachkommastellen).
+    Mit max_tokens werden die am wenigsten ähnlichen Songs weggelassen, bis der Kontext in das Budget
+    passt; der ähnlichste Song bleibt immer erhalten.
+
+    :param retrieval: Die Ergebnisse von RAG.retrieve_only.
+    :param max_tokens: Token-Budget für den Kontext (None für unbegrenzt).
+    :param model_name: Modell, dessen Tokenizer für die Zählung verwendet wird.
+    :return: Eine Liste mit einem Abschnitt (leer, falls nichts gefunden wurde).
+    """
+    if not retrieval:
+        return []
+
+    header = _csv_line(CONTEXT_COLUMNS)
+    lines = [_csv_line(row) for row in context_rows(retrieval)]
+
+    def render(count):
+        return COMPACT_TITLE.format(count) + header + "".join(lines[:count])
+
+    count = len(lines)
+    if max_tokens is not None:
+        # Schätzung über die Tokens je Zeile, danach Prüfung des gesamten Abschnitts
+        budget = max_tokens - count_tokens(render(0), model_name)
+        count = 0
+        for line in lines:
+            budget -= count_tokens(line, model_name)
+            if budget < 0:
+                break
+            count += 1
+        count = max(count, 1)
+        while count > 1 and count_tokens(render(count), model_name) > max_tokens:
+            count -= 1
+
+    return [render(count)]
@@ -0,0 +1,214 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.utils.formatting import VECTOR_COLUMNS
+
+FEATURE_STORE_DIR = "src/data/preprocessed/feature_store"
+FORMAT_VERSION = 1
+
+MANIFEST_FILE = "manifest.json"
+METADATA_FILE = "metadata.parquet"
+EMBEDDINGS_FILE = "embeddings.npy"
+STATISTICS_FILE = "statistics.npz"
+STORE_FILES = [METADATA_FILE, EMBEDDINGS_FILE, STATISTICS_FILE]
+
+METADATA_COLUMNS = ["ID", "Name", "Label"]
+METADATA_SCHEMA = pa.schema([(column, pa.string()) for column in METADATA_COLUMNS])
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class FeatureStoreWriter:
+    """
+    Schreibt den Feature Store blockweise: Metadaten (ID, Name, Label) als Parquet, die Embeddings
+    als float32-Matrix im .npy-Format (direkt über eine Memory Map) und Kovarianzmatrix sowie
+    Normalisierungsparameter als .npz. Das Manifest mit Version und Prüfsummen wird zuletzt
+    geschrieben, sodass Leser nie einen halb geschriebenen Store als gültig ansehen.
+
+    :param directory: Zielverzeichnis des Feature Stores.
+    :param rows: Anzahl der Tracks, die insgesamt geschrieben werden.
+    """
+
+    def __init__(self, directory, rows):
+        self.directory = directory
+        self.rows = rows
+        self._offset = 0
+        os.makedirs(directory, exist_ok=True)
+        # Altes Manifest zuerst entfernen, damit der Store während des Schreibens als ungültig gilt
+        manifest = os.path.join(directory, MANIFEST_FILE)
+        if os.path.exists(manifest):
+            os.remove(manifest)
+
+        self._metadata = pq.ParquetWriter(os.path.join(directory, METADATA_FILE), METADATA_SCHEMA)
+        self._embeddings = np.lib.format.open_memmap(
+            os.path.join(directory, EMBEDDINGS_FILE), mode="w+", dtype=np.float32, shape=(rows, len(VECTOR_COLUMNS))
+        )
+
+    def add(self, df):
+        """
+        Hängt einen Block mit den Spalten ID, Name, VECTOR_COLUMNS und Label an.
+        """
+        end = self._offset + len(df)
+        if end > self.rows:
+            raise ValueError(f"Mehr Tracks als angekündigt ({end} > {self.rows})")
+        metadata = df[METADATA_COLUMNS].astype(object).where(df[METADATA_COLUMNS].notna(), None)
+        self._metadata.write_table(pa.Table.from_pandas(metadata, schema=METADATA_SCHEMA, preserve_index=False))
+        self._embeddings[self._offset:end] = df[VECTOR_COLUMNS].to_numpy(dtype=np.float32)
+        self._offset = end
+
+    def close(self, covariance, params):
+        """
+        Schließt die Dateien ab und schreibt das Manifest.
+
+        :param covariance: Kovarianzmatrix (DataFrame oder Array) in der Reihenfolge von VECTOR_COLUMNS.
+        :param params: Normalisierungsparameter {"min": {...}, "max": {...}}; fehlende Spalten werden als NaN gespeichert.
+        :return: Das Manifest.
+        """
+        if self._offset != self.rows:
+            raise ValueError(f"Weniger Tracks als angekündigt ({self._offset} < {self.rows})")
+        self._metadata.close()
+        self._embeddings.flush()
+        del self._embeddings
+
+        def ordered(values):
+            return np.array([np.nan if values.get(column) is None else values[column] for column in VECTOR_COLUMNS], dtype=np.float64)
+
+        np.savez(
+            os.path.join(self.directory, STATISTICS_FILE),
+            covariance=np.asarray(covariance, dtype=np.float64),
+            minimum=ordered(params["min"]),
+            maximum=ordered(params["max"]),
+        )
+
+        files = {}
+        for name in STORE_FILES:
+            path = os.path.join(self.directory, name)
+            files[name] = {"sha256": _file_sha256(path), "bytes": os.path.getsize(path)}
+        version = hashlib.sha256("".join(files[name]["sha256"] for name in STORE_FILES).encode("ascii")).hexdigest()[:16]
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "version": version,
+            "rows": self.rows,
+            "columns": VECTOR_COLUMNS,
+            "files": files,
+        }
+
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(manifest, file, indent=4)
+        os.replace(path + ".tmp", path)
+        return manifest
+
+class FeatureStore:
+    """
+    Lesender Zugriff auf einen Feature Store. Die Embeddings werden per Memory Map eingebunden und
+    nicht in den Arbeitsspeicher kopiert, Metadaten und Statistiken sind klein und werden geladen.
+
+    :param directory: Verzeichnis des Feature Stores.
+    :param verify: Ob die SHA-256-Prüfsummen aller Dateien geprüft werden (sonst nur die Dateigrößen).
+    """
+
+    def __init__(self, directory=FEATURE_STORE_DIR, verify=False):
+        self.directory = directory
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(
+                f"Kein Feature Store in {directory} gefunden. Bitte zuerst 'python -m src.data.data_preprocessing' ausführen."
+            )
+        with open(manifest_path, "r", encoding="utf-8") as file:
+            self.manifest = json.load(file)
+
+        if self.manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(
+                f"Feature Store in {directory} hat Formatversion {self.manifest.get('format_version')}, erwartet wird {FORMAT_VERSION}."
+            )
+        if self.manifest["columns"] != VECTOR_COLUMNS:
+            raise ValueError(f"Die Merkmale des Feature Stores in {directory} passen nicht zu VECTOR_COLUMNS.")
+        for name, expected in self.manifest["files"].items():
+            path = os.path.join(directory, name)
+            if not os.path.exists(path) or os.path.getsize(path) != expected["bytes"] or (verify and _file_sha256(path) != expected["sha256"]):
+                raise ValueError(
+                    f"Die Datei {path} passt nicht zum Manifest. Bitte 'python -m src.data.data_preprocessing' erneut ausführen."
+                )
+
+        metadata = pq.read_table(os.path.join(directory, METADATA_FILE)).to_pandas()
+        self.ids = metadata["ID"].to_numpy(dtype=object)
+        self.names = metadata["Name"].to_numpy(dtype=object)
+        self.labels = metadata["Label"].to_numpy(dtype=object)
+        self.embeddings = np.load(os.path.join(directory, EMBEDDINGS_FILE), mmap_mode="r")
+
+        with np.load(os.path.join(directory, STATISTICS_FILE)) as statistics:
+            self.covariance = statistics["covariance"]
+            self.minimum = statistics["minimum"]
+            self.maximum = statistics["maximum"]
+
+        if len(self.ids) != self.manifest["rows"] or self.embeddings.shape != (self.manifest["rows"], len(VECTOR_COLUMNS)):
+            raise ValueError(f"Die Anzahl der Tracks im Feature Store {directory} passt nicht zum Manifest.")
+
+    @property
+    def version(self):
+        return self.manifest["version"]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def frame(self, start=0, stop=None):
+        """
+        Gibt (einen Ausschnitt der) Tracks als DataFrame mit den Spalten ID, Name, VECTOR_COLUMNS und Label zurück.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        data = pd.DataFrame(np.asarray(self.embeddings[start:stop], dtype=np.float64), columns=VECTOR_COLUMNS)
+        data.insert(0, "ID", self.ids[start:stop])
+        data.insert(1, "Name", self.names[start:stop])
+        data["Label"] = self.labels[start:stop]
+        return data
+
+    def iter_frames(self, chunk_size=50_000):
+        """
+        Gibt die Tracks blockweise als DataFrames zurück (siehe frame).
+        """
+        for start in range(0, len(self), chunk_size):
+            yield self.frame(start, start + chunk_size)
+
+_stores = {}
+_lock = threading.Lock()
+
+def _signature(directory):
+    # Änderungszeit und Größe aller Dateien; ändert sich eine davon, wird der Store neu geladen
+    signature = []
+    for name in [MANIFEST_FILE, *STORE_FILES]:
+        try:
+            stat = os.stat(os.path.join(directory, name))
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+def load_feature_store(directory=FEATURE_STORE_DIR, verify=False):
+    """
+    Lädt den Feature Store einmal pro Prozess. Wird der Store neu geschrieben (z.B. durch die
+    Vorverarbeitung), wird er beim nächsten Aufruf automatisch neu geladen.
+
+    :param directory: Verzeichnis des Feature Stores.
+    :param verify: Ob die Prüfsummen beim (Neu-)Laden geprüft werden.
+    :return: Ein FeatureStore.
+    """
+    directory = os.path.abspath(directory)
+    signature = _signature(directory)
+    with _lock:
+        cached = _stores.get(directory)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        store = FeatureStore(directory, verify=verify)
+        _stores[directory] = (signature, store)
+        return store
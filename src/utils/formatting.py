@@ -1,3 +1,14 @@
+# Merkmale eines Songs in der Reihenfolge der Embeddings
+VECTOR_COLUMNS = [
+    "Danceability", "Energy", "Key", "Loudness", "Mode", "Speechiness",
+    "Acousticness", "Instrumentalness", "Liveness", "Valence", "Tempo",
+    "Duration_ms", "Time_Signature"
+]
+
+def vector_to_literal(vector):
+    # Vektor in das Textformat von pgvector umwandeln, z.B. '[0.1,0.2,0.3]'
+    return f"[{','.join(map(str, vector))}]"
+
 
 def vector_to_query(vector):
     # Initialisierung für dynamische Spaltenbreiten
@@ -0,0 +1,60 @@
+import math
+import numpy as np
+
+from src.evaluation.similarity.metrics import get_metrics_engine
+from src.utils.context import parse_embedding
+
+# Lokale Generierungs-"Modelle": Mehrheit der Labels der Top-k Tracks, ungewichtet bzw. nach Distanz gewichtet
+KNN_MODELS = ["knn-vote", "knn-vote-weighted"]
+
+# Untergrenze der Distanz für die Gewichtung 1/d, damit sehr nahe Tracks nicht zu einer Division durch 0 führen
+MIN_DISTANCE = 1e-12
+
+def neighbor_weights(vector, neighbors, metric):
+    """
+    Gewichte der Nachbarn für die gewichtete Abstimmung: 1/Distanz in der Metrik der Suche,
+    beim Skalarprodukt die Ähnlichkeit selbst. Nachbarn mit undefinierter Distanz erhalten das Gewicht 0.
+
+    :param vector: Der Anfragevektor.
+    :param neighbors: Die Ergebnisse von RAG.retrieve_only.
+    :param metric: Die Metrik der Similarity Search.
+    :return: Ein Array mit einem Gewicht pro Nachbar.
+    """
+    query = np.asarray(vector, dtype=np.float64)
+    embeddings = np.asarray([parse_embedding(neighbor["embedding"]) for neighbor in neighbors], dtype=np.float64)
+    if metric == "inner_product":
+        return np.maximum(np.nan_to_num(embeddings @ query), 0.0)
+
+    metrics = get_metrics_engine().compute(query, embeddings)
+    distances = {
+        "cosine": 1.0 - metrics["Cosine Similarity"],
+        "euclidean": metrics["Euclidean Distance"],
+        "manhattan": metrics["Manhattan Distance"],
+        "mahalanobis": metrics["Mahalanobis Distance"],
+        "pearson": 1.0 - metrics["Pearson Correlation"],
+    }[metric]
+    distances = np.nan_to_num(distances, nan=np.inf)
+    return 1.0 / np.maximum(distances, MIN_DISTANCE)
+
+def knn_vote(vector, neighbors, metric, weighted=False):
+    """
+    Sagt das Label eines Songs als Mehrheit der Labels seiner nächsten Nachbarn voraus.
+    Bei Gleichstand entscheidet der ähnlichste Nachbar unter den gleichauf liegenden Labels.
+
+    :param vector: Der Anfragevektor.
+    :param neighbors: Die Ergebnisse von RAG.retrieve_only, sortiert nach Ähnlichkeit.
+    :param metric: Die Metrik der Similarity Search.
+    :param weighted: Ob die Stimmen nach Distanz gewichtet werden (siehe neighbor_weights).
+    :return: Das vorhergesagte Label ('like' oder 'dislike') oder None ohne Nachbarn.
+    """
+    if not neighbors:
+        return None
+
+    weights = neighbor_weights(vector, neighbors, metric) if weighted else np.ones(len(neighbors))
+    votes = {}
+    for neighbor, weight in zip(neighbors, weights):
+        votes[neighbor["label"]] = votes.get(neighbor["label"], 0.0) + float(weight)
+
+    best = max(votes.values())
+    winners = {label for label, count in votes.items() if math.isclose(count, best, rel_tol=1e-9)}
+    return next(neighbor["label"] for neighbor in neighbors if neighbor["label"] in winners)
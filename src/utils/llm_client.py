@@ -0,0 +1,184 @@
+import os
+import time
+import random
+import importlib.util
+from contextlib import nullcontext
+from email.utils import parsedate_to_datetime
+import httpx
+
+from src.utils.rate_limit import estimate_tokens
+
+# Generierungsmodelle je Provider
+GROQ_MODELS = [
+    "gemma2-9b-it", "llama-3.1-70b-versatile", "llama-3.1-8b-instant",
+    "llama-3.2-11b-vision-preview", "llama-3.2-1b-preview",
+    "llama-3.2-3b-preview", "llama-3.2-90b-vision-preview",
+    "llama-3.3-70b-specdec", "llama-3.3-70b-versatile",
+    "llama-guard-3-8b", "llama3-70b-8192", "llama3-8b-8192",
+    "mixtral-8x7b-32768",
+]
+OPENAI_MODELS = ["gpt-4o", "gpt-4o-mini", "o1", "o1-mini", "gpt-3.5-turbo"]
+
+# o1-Modelle akzeptieren keinen Parameter 'temperature'
+NO_TEMPERATURE_MODELS = ["o1", "o1-mini"]
+
+PROVIDERS = {
+    "groq": {"base_url": "https://api.groq.com/openai/v1", "api_key": "GROQ_API_KEY"},
+    "openai": {"base_url": "https://api.openai.com/v1", "api_key": "OPENAI_API_KEY"},
+}
+
+# Statuscodes, bei denen die Anfrage wiederholt wird
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+class LLMError(RuntimeError):
+    """
+    Fehler bei einer Anfrage an ein Generierungsmodell (z.B. Fehlerantwort oder Antwort ohne 'choices').
+    """
+
+def _env_float(name, default):
+    return float(os.getenv(name, default))
+
+def provider_for_model(model_name):
+    """
+    Bestimmt den Provider ('groq' oder 'openai') eines Generierungsmodells.
+    """
+    if model_name in GROQ_MODELS:
+        return "groq"
+    if model_name in OPENAI_MODELS:
+        return "openai"
+    raise ValueError(f"Unbekanntes Generierungsmodell '{model_name}'.")
+
+def _retry_after(response):
+    """
+    Liest die Wartezeit aus dem Header 'Retry-After' (Sekunden oder HTTP-Datum).
+
+    :return: Die Wartezeit in Sekunden oder None.
+    """
+    value = response.headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class LLMClient:
+    """
+    Gemeinsamer HTTP-Client für die Chat-Completions-Endpunkte von Groq und OpenAI.
+
+    Alle Anfragen laufen über einen httpx.Client mit wiederverwendeten Keep-Alive-Verbindungen
+    (HTTP/2, falls das Paket 'h2' installiert ist) sowie Connect- und Read-Timeouts. Bei 429,
+    5xx und Verbindungsfehlern wird mit exponentiellem Backoff und Jitter erneut versucht;
+    ein 'Retry-After'-Header hat dabei Vorrang.
+
+    :param connect_timeout: Timeout für den Verbindungsaufbau in Sekunden (Standard: LLM_CONNECT_TIMEOUT oder 5).
+    :param read_timeout: Timeout für das Lesen der Antwort in Sekunden (Standard: LLM_READ_TIMEOUT oder 60).
+    :param max_retries: Maximale Anzahl an Wiederholungen (Standard: LLM_MAX_RETRIES oder 5).
+    :param backoff_base: Wartezeit vor der ersten Wiederholung in Sekunden.
+    :param backoff_max: Maximale Wartezeit zwischen zwei Versuchen in Sekunden.
+    :param max_connections: Maximale Anzahl gleichzeitiger Verbindungen.
+    :param scheduler: Optionaler RateLimitScheduler, über den jede Anfrage eingeplant wird.
+    """
+
+    def __init__(self, connect_timeout=None, read_timeout=None, max_retries=None, backoff_base=0.5, backoff_max=30.0, max_connections=20, scheduler=None):
+        connect_timeout = connect_timeout if connect_timeout is not None else _env_float("LLM_CONNECT_TIMEOUT", 5)
+        read_timeout = read_timeout if read_timeout is not None else _env_float("LLM_READ_TIMEOUT", 60)
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("LLM_MAX_RETRIES", 5))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.scheduler = scheduler
+        self._client = httpx.Client(
+            http2=importlib.util.find_spec("h2") is not None,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections, keepalive_expiry=60),
+        )
+
+    def _backoff(self, attempt):
+        # Exponentieller Backoff mit "Full Jitter"
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def post(self, url, headers, payload, model_scheduler=None, tokens=0):
+        """
+        Sendet eine POST-Anfrage und wiederholt sie bei vorübergehenden Fehlern.
+
+        :param model_scheduler: Optionaler ModelScheduler, der jeden Versuch einplant und aus den
+                                Rate-Limit-Headern der Antwort lernt.
+        :param tokens: Geschätzte Tokens der Anfrage für den Scheduler.
+        :return: Die httpx.Response der letzten Anfrage.
+        """
+        attempt = 0
+        while True:
+            try:
+                with model_scheduler.slot(tokens) if model_scheduler is not None else nullcontext():
+                    response = self._client.post(url, headers=headers, json=payload)
+            except httpx.TransportError:
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            wait = _retry_after(response)
+            if model_scheduler is not None:
+                model_scheduler.record(response.status_code, response.headers, wait)
+
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                return response
+
+            time.sleep(min(self.backoff_max, wait) if wait is not None else self._backoff(attempt))
+            attempt += 1
+
+    def chat_completion(self, model_name, messages):
+        """
+        Fragt eine Chat-Completion beim passenden Provider an.
+
+        :param model_name: Das Generierungsmodell (siehe GROQ_MODELS und OPENAI_MODELS).
+        :param messages: Die Nachrichten im Chat-Completions-Format.
+        :return: Die Antwort des Providers als Dictionary.
+        """
+        provider_name = provider_for_model(model_name)
+        provider = PROVIDERS[provider_name]
+        api_key = os.getenv(provider["api_key"])
+        if not api_key:
+            raise ValueError("API-Key ist nicht gesetzt. Bitte .env-Datei prüfen.")
+
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+        payload = {
+            "model": model_name,
+            "messages": messages
+        }
+        # Wie bisher: deterministische Antworten bei OpenAI, Standardwerte bei Groq
+        if provider_name == "openai" and model_name not in NO_TEMPERATURE_MODELS:
+            payload["temperature"] = 0
+
+        model_scheduler = self.scheduler.for_model(model_name) if self.scheduler is not None else None
+        tokens = estimate_tokens(messages)
+        response = self.post(f"{provider['base_url']}/chat/completions", headers, payload, model_scheduler, tokens)
+
+        try:
+            result = response.json()
+        except ValueError:
+            result = {}
+        if response.status_code >= 400:
+            error = result.get("error") if isinstance(result, dict) else None
+            message = error.get("message") if isinstance(error, dict) else response.text[:200]
+            raise LLMError(f"Anfrage an {provider_name} ({model_name}) fehlgeschlagen mit Status {response.status_code}: {message}")
+        if not isinstance(result, dict) or not result.get("choices"):
+            raise LLMError(f"Antwort von {provider_name} ({model_name}) enthält keine 'choices': {response.text[:200]}")
+
+        if model_scheduler is not None:
+            model_scheduler.settle(tokens, (result.get("usage") or {}).get("total_tokens"))
+        return result
+
+    def close(self):
+        """
+        Schließt die Verbindungen des Clients.
+        """
+        self._client.close()
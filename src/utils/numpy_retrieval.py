@@ -0,0 +1,192 @@
+import numpy as np
+
+from src.evaluation.similarity.mahalanobis import load_whitening_matrix
+from src.utils.feature_store import FEATURE_STORE_DIR, load_feature_store
+from src.utils.retrieval import center, get_search_metric, whiten
+
+BACKENDS = ["pgvector", "numpy", "kdtree"]
+
+def format_float4(value) -> str:
+    """
+    Formatiert eine Zahl wie die Textausgabe von pgvector (float4 in PostgreSQL):
+    kürzeste Darstellung, die als float32 eindeutig ist, ohne abschließendes ".0" und
+    mit Exponent wie printf ("%g"), wenn der Exponent kleiner als -4 oder mindestens 6 ist.
+
+    :param value: Die Zahl, sie wird auf float32 gerundet.
+    :return: Die Zahl als String, z.B. "1", "0.1", "1e-05" oder "1.234567e+06".
+    """
+    value = np.float32(value)
+    scientific = np.format_float_scientific(value, unique=True, trim="-", exp_digits=2)
+    exponent = int(scientific.split("e")[1])
+    if -4 <= exponent < 6:
+        return np.format_float_positional(value, unique=True, trim="-")
+    return scientific
+
+def format_vector(values) -> str:
+    """
+    Formatiert einen Vektor im Textformat von pgvector, z.B. "[1,0.5,-2.25]".
+
+    :param values: Die Komponenten des Vektors.
+    :return: Der Vektor als String.
+    """
+    return "[" + ",".join(format_float4(value) for value in values) + "]"
+
+def load_embedding_matrix(directory=FEATURE_STORE_DIR):
+    """
+    Gibt IDs, Namen, Labels und die Embedding-Matrix aus dem Feature Store zurück.
+    Die Embeddings liegen wie in pgvector als float32 vor und werden per Memory Map gelesen.
+    """
+    store = load_feature_store(directory)
+    return store.ids, store.names, store.labels, store.embeddings
+
+class NumpyRetriever:
+    """
+    Exakte Similarity Search im Arbeitsspeicher als Alternative zu pgvector.
+
+    Die Distanzen werden für einen ganzen Batch von Anfragen über Matrixprodukte (BLAS) berechnet,
+    die Top-k über argpartition bestimmt. Für die euklidische und die Manhattan-Distanz kann optional
+    ein KD-Baum verwendet werden, der bei wenigen Dimensionen schneller ist. Mahalanobis wird als
+    euklidische Suche auf den geweißten Embeddings beantwortet, Pearson als Cosinus-Suche auf den
+    zentrierten Embeddings. Wie bei pgvector werden
+    Tracks mit identischem Embedding ausgeschlossen und die Ergebnisse im Format von
+    RAG.retrieve_only zurückgegeben.
+
+    :param metric: Die Metrik für die Similarity Search (siehe SEARCH_METRICS).
+    :param limit: Die maximale Anzahl von Ergebnissen pro Anfrage.
+    :param kdtree: Ob für unterstützte Metriken ein KD-Baum verwendet wird.
+    :param feature_store: Verzeichnis des Feature Stores mit den Embeddings.
+    """
+
+    # Metriken mit KD-Baum-Unterstützung und der zugehörigen Minkowski-Norm
+    KDTREE_METRICS = {"euclidean": 2, "mahalanobis": 2, "manhattan": 1}
+
+    def __init__(self, metric, limit, kdtree=False, feature_store=FEATURE_STORE_DIR):
+        get_search_metric(metric)
+
+        self.metric = metric
+        self.limit = int(limit)
+        self.ids, self.names, self.labels, self.embeddings = load_embedding_matrix(feature_store)
+        self._whitening = load_whitening_matrix(feature_store) if metric == "mahalanobis" else None
+        self._matrix = self.embeddings.astype(np.float64)
+        self._embedding_strings = {}
+
+        # Zeilen mit identischem Embedding, um sie wie in pgvector auszuschließen
+        self._rows_by_embedding = {}
+        for index, row in enumerate(self.embeddings):
+            self._rows_by_embedding.setdefault(row.tobytes(), []).append(index)
+
+        if metric == "cosine":
+            norms = np.linalg.norm(self._matrix, axis=1, keepdims=True)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                self._matrix = self._matrix / norms
+        elif metric == "pearson":
+            self._matrix = center(self._matrix)
+            self._zero_rows = ~self._matrix.any(axis=1)
+        elif metric == "mahalanobis":
+            self._matrix = whiten(self._matrix, self._whitening)
+        if metric in ["euclidean", "mahalanobis"]:
+            self._squared_norms = np.einsum("ij,ij->i", self._matrix, self._matrix)
+
+        self._tree = None
+        if kdtree and metric in self.KDTREE_METRICS:
+            from scipy.spatial import cKDTree
+            self._tree = cKDTree(self._matrix)
+
+    def _distances(self, queries):
+        if self.metric == "cosine":
+            with np.errstate(divide="ignore", invalid="ignore"):
+                queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+            return 1.0 - queries @ self._matrix.T
+        if self.metric == "pearson":
+            # Zentrierte Vektoren ohne Varianz sind Nullvektoren, die Korrelation ist dort undefiniert
+            similarities = center(queries) @ self._matrix.T
+            similarities[:, self._zero_rows] = np.nan
+            return 1.0 - similarities
+        if self.metric == "manhattan":
+            from scipy.spatial.distance import cdist
+            return cdist(queries, self._matrix, metric="cityblock")
+        if self.metric in ["euclidean", "mahalanobis"]:
+            # ||x - q||² = ||x||² - 2 x·q + ||q||², für die Rangfolge genügt die quadrierte Distanz
+            squared = self._squared_norms[None, :] - 2.0 * (queries @ self._matrix.T)
+            squared += np.einsum("ij,ij->i", queries, queries)[:, None]
+            return np.maximum(squared, 0.0)
+        # pgvector sortiert beim Skalarprodukt nach dem negativen Wert
+        return -(queries @ self._matrix.T)
+
+    def _excluded(self, queries32):
+        return [self._rows_by_embedding.get(query.tobytes(), []) for query in queries32]
+
+    def _top_k_brute_force(self, queries, excluded):
+        distances = self._distances(queries)
+        distances[np.isnan(distances)] = np.inf
+        for row, indices in enumerate(excluded):
+            distances[row, indices] = np.inf
+
+        k = min(self.limit, distances.shape[1])
+        if k == 0:
+            return [[] for _ in range(len(queries))]
+        candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+
+        results = []
+        for row, indices in enumerate(candidates):
+            values = distances[row, indices]
+            # Nach Distanz sortieren, bei Gleichstand nach Zeilenindex
+            order = np.lexsort((indices, values))
+            results.append([index for index in indices[order] if np.isfinite(distances[row, index])])
+        return results
+
+    def _top_k_kdtree(self, queries, excluded):
+        extra = max((len(indices) for indices in excluded), default=0)
+        k = min(self.limit + extra, len(self.ids))
+        if k == 0:
+            return [[] for _ in range(len(queries))]
+        _, neighbors = self._tree.query(queries, k=k, p=self.KDTREE_METRICS[self.metric])
+        neighbors = np.asarray(neighbors).reshape(len(queries), k)
+
+        results = []
+        for row, indices in enumerate(neighbors):
+            skip = set(excluded[row])
+            kept = [index for index in indices if index < len(self.ids) and index not in skip]
+            results.append(kept[:self.limit])
+        return results
+
+    def _format_embedding(self, index):
+        # Embedding im Textformat von pgvector, wie es retrieve_only zurückgibt
+        if index not in self._embedding_strings:
+            self._embedding_strings[index] = format_vector(self.embeddings[index])
+        return self._embedding_strings[index]
+
+    def search(self, vectors) -> list:
+        """
+        Sucht die Top-k Tracks für mehrere Anfragevektoren.
+
+        :param vectors: Liste von Vektoren (Listen von Zahlen).
+        :return: Eine Liste mit einer Ergebnisliste pro Vektor im Format von RAG.retrieve_only.
+        """
+        if len(vectors) == 0:
+            return []
+
+        # Anfragen wie in pgvector auf float32 runden, gerechnet wird in float64
+        queries32 = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        queries = queries32.astype(np.float64)
+        if self.metric == "mahalanobis":
+            queries = whiten(queries, self._whitening)
+        excluded = self._excluded(queries32)
+
+        if self._tree is not None:
+            top_k = self._top_k_kdtree(queries, excluded)
+        else:
+            top_k = self._top_k_brute_force(queries, excluded)
+
+        return [
+            [
+                {
+                    "id": self.ids[index],
+                    "name": self.names[index],
+                    "label": self.labels[index],
+                    "embedding": self._format_embedding(index)
+                }
+                for index in indices
+            ]
+            for indices in top_k
+        ]
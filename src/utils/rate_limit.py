@@ -0,0 +1,258 @@
+import re
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Geschätzte Anzahl an Tokens in der Antwort, wird nach der Antwort mit 'usage' abgeglichen
+DEFAULT_COMPLETION_TOKENS = 64
+
+def estimate_tokens(payload):
+    """
+    Grobe Schätzung der Tokens einer Anfrage (ca. 4 Zeichen pro Token).
+    """
+    text = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+    return len(text) // 4 + DEFAULT_COMPLETION_TOKENS
+
+def parse_reset(value):
+    """
+    Wandelt eine Reset-Angabe der Rate-Limit-Header (z.B. '1m30.5s', '6ms', '2s') in Sekunden um.
+
+    :return: Die Dauer in Sekunden oder None.
+    """
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+def parse_rate_limits(entries):
+    """
+    Liest Rate-Limits im Format 'MODELL=ANFRAGEN:TOKENS' (pro Minute, leere Angabe = unbegrenzt).
+
+    :param entries: Liste von Einträgen, z.B. ['gpt-4o-mini=500:200000', 'llama-3.3-70b-versatile=30:6000'].
+    :return: Ein Dictionary {Modell: {"requests_per_minute": ..., "tokens_per_minute": ...}}.
+    """
+    limits = {}
+    for entry in entries or []:
+        try:
+            model, values = entry.split("=", 1)
+            requests, _, tokens = values.partition(":")
+            limits[model] = {
+                "requests_per_minute": float(requests) if requests else None,
+                "tokens_per_minute": float(tokens) if tokens else None,
+            }
+        except ValueError:
+            raise ValueError(f"Ungültiges Rate-Limit '{entry}'. Erwartet wird 'MODELL=ANFRAGEN:TOKENS'.")
+    return limits
+
+class TokenBucket:
+    """
+    Token-Bucket, der mit einer festen Rate aufgefüllt wird. Ohne Rate ist der Bucket unbegrenzt,
+    bis über sync() Werte aus den Rate-Limit-Headern des Providers übernommen werden.
+
+    :param per_minute: Auffüllrate pro Minute (None = unbegrenzt).
+    """
+
+    def __init__(self, per_minute=None):
+        self.rate = per_minute / 60.0 if per_minute else None
+        self.capacity = per_minute
+        self.available = per_minute
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if self.rate is not None:
+            self.available = min(self.capacity, self.available + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount=1):
+        """
+        Blockiert, bis 'amount' Einheiten verfügbar sind, und entnimmt sie.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._blocked_until - now
+                if wait <= 0:
+                    if self.rate is None:
+                        return
+                    # Anfragen größer als der Bucket dürfen nicht für immer warten
+                    amount = min(amount, self.capacity)
+                    if self.available >= amount:
+                        self.available -= amount
+                        return
+                    wait = (amount - self.available) / self.rate
+            time.sleep(wait)
+
+    def adjust(self, amount):
+        """
+        Korrigiert den Bestand nachträglich, z.B. um die Differenz zwischen geschätzten und verbrauchten Tokens.
+        """
+        with self._lock:
+            if self.rate is not None:
+                self.available = min(self.capacity, self.available - amount)
+
+    def block(self, seconds):
+        """
+        Sperrt den Bucket für die angegebene Dauer (z.B. nach einem 429 mit 'Retry-After').
+        """
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def sync(self, limit=None, remaining=None, reset=None):
+        """
+        Übernimmt den Stand aus den Rate-Limit-Headern des Providers. Die Auffüllrate ergibt sich
+        daraus, wie lange der Provider braucht, um vom aktuellen Stand wieder auf das Limit zu kommen.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if limit is not None and limit > 0:
+                self.capacity = limit
+                if reset and remaining is not None and remaining < limit:
+                    self.rate = (limit - remaining) / reset
+                elif self.rate is None:
+                    self.rate = limit / 60.0
+                if self.available is None:
+                    self.available = limit
+            if remaining is not None and self.available is not None:
+                # Der Provider kennt auch Anfragen anderer Clients, daher den kleineren Wert übernehmen
+                self.available = min(self.available, remaining)
+            if remaining is not None and remaining <= 0 and reset:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + reset)
+
+class AdaptiveConcurrency:
+    """
+    Begrenzt die gleichzeitigen Anfragen und passt das Limit nach dem AIMD-Verfahren an:
+    nach erfolgreichen Anfragen steigt es langsam, nach einem 429 wird es halbiert.
+
+    :param maximum: Obergrenze (und Startwert) der gleichzeitigen Anfragen.
+    """
+
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self.active = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.active >= max(1, int(self.limit)):
+                self._condition.wait()
+            self.active += 1
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def increase(self):
+        with self._condition:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+    def decrease(self):
+        with self._condition:
+            self.limit = max(1.0, self.limit / 2)
+
+class ModelScheduler:
+    """
+    Plant die Anfragen an ein Modell über je einen Token-Bucket für Anfragen und Tokens pro Minute
+    sowie ein adaptives Limit für gleichzeitige Anfragen.
+
+    :param requests_per_minute: Erlaubte Anfragen pro Minute (None = aus den Headern lernen).
+    :param tokens_per_minute: Erlaubte Tokens pro Minute (None = aus den Headern lernen).
+    :param max_concurrency: Obergrenze für gleichzeitige Anfragen.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_concurrency=16):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.throttled = 0
+
+    @contextmanager
+    def slot(self, tokens):
+        """
+        Wartet, bis eine Anfrage mit 'tokens' geschätzten Tokens gesendet werden darf.
+        """
+        self.concurrency.acquire()
+        try:
+            self.requests.acquire(1)
+            self.tokens.acquire(tokens)
+            yield
+        finally:
+            self.concurrency.release()
+
+    def record(self, status_code, headers, retry_after=None):
+        """
+        Passt den Scheduler an die Antwort des Providers an (Rate-Limit-Header und Statuscode).
+        """
+        def header(name):
+            value = headers.get(name)
+            try:
+                return float(value) if value is not None else None
+            except ValueError:
+                return None
+
+        self.requests.sync(header("x-ratelimit-limit-requests"), header("x-ratelimit-remaining-requests"),
+                           parse_reset(headers.get("x-ratelimit-reset-requests")))
+        self.tokens.sync(header("x-ratelimit-limit-tokens"), header("x-ratelimit-remaining-tokens"),
+                         parse_reset(headers.get("x-ratelimit-reset-tokens")))
+
+        if status_code == 429:
+            self.throttled += 1
+            self.concurrency.decrease()
+            if retry_after:
+                self.requests.block(retry_after)
+        elif status_code < 400:
+            self.concurrency.increase()
+
+    def settle(self, estimated, used):
+        """
+        Gleicht die geschätzten mit den tatsächlich verbrauchten Tokens ab.
+        """
+        if used is not None:
+            self.tokens.adjust(used - estimated)
+
+class RateLimitScheduler:
+    """
+    Gemeinsamer Scheduler für alle Modellaufrufe (Generierung und TruLens-Feedback) mit einem
+    ModelScheduler pro Modell.
+
+    :param limits: Rate-Limits je Modell, z.B. aus parse_rate_limits().
+    :param max_concurrency: Obergrenze für gleichzeitige Anfragen pro Modell.
+    """
+
+    def __init__(self, limits=None, max_concurrency=16):
+        self.limits = limits or {}
+        self.max_concurrency = max_concurrency
+        self._schedulers = {}
+        self._lock = threading.Lock()
+
+    def for_model(self, model_name):
+        """
+        Gibt den ModelScheduler eines Modells zurück (wird beim ersten Aufruf erzeugt).
+        """
+        with self._lock:
+            if model_name not in self._schedulers:
+                self._schedulers[model_name] = ModelScheduler(**self.limits.get(model_name, {}), max_concurrency=self.max_concurrency)
+            return self._schedulers[model_name]
+
+    def stats(self):
+        """
+        Gibt pro Modell die Anzahl gedrosselter Anfragen (429) und das aktuelle Parallelitätslimit zurück.
+        """
+        with self._lock:
+            return {
+                model_name: {"throttled": scheduler.throttled, "concurrency": int(scheduler.concurrency.limit)}
+                for model_name, scheduler in self._schedulers.items()
+            }
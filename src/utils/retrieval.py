@@ -1,60 +1,214 @@
-from src.utils.connect_db import connect_to_db
+import threading
+from concurrent.futures import Future
+from src.utils.connect_db import get_pool
+import numpy as np
+from src.utils.formatting import vector_to_literal
+from src.evaluation.similarity.mahalanobis import load_whitening_matrix
 
-def retrieval(input_vector, limit=10, metric="cosine", include_identical=True):
+# Unterstützte Metriken mit der durchsuchten Spalte, den zugehörigen pgvector-Operatoren
+# und Operator-Klassen für Indizes. Mahalanobis wird als euklidische Suche auf der
+# mit der Kovarianzmatrix geweißten Spalte 'embedding_whitened' umgesetzt, Pearson als
+# Cosinus-Suche auf der zeilenweise zentrierten und normierten Spalte 'embedding_centered'.
+SEARCH_METRICS = {
+    "cosine": {"column": "embedding", "operator": "<=>", "opclass": "vector_cosine_ops"},
+    "euclidean": {"column": "embedding", "operator": "<->", "opclass": "vector_l2_ops"},
+    "inner_product": {"column": "embedding", "operator": "<#>", "opclass": "vector_ip_ops"},
+    "manhattan": {"column": "embedding", "operator": "<+>", "opclass": "vector_l1_ops"},
+    "mahalanobis": {"column": "embedding_whitened", "operator": "<->", "opclass": "vector_l2_ops"},
+    "pearson": {"column": "embedding_centered", "operator": "<=>", "opclass": "vector_cosine_ops"},
+}
+
+def whiten(vectors, whitening=None):
     """
-    Führt eine Similarity Search mit einer wählbaren Metrik durch und gibt die Ergebnisse als Dictionary zurück.
+    Weißt Vektoren mit der Kovarianzmatrix, sodass die euklidische Distanz der Mahalanobis-Distanz entspricht.
+
+    :param vectors: Ein Vektor (d,) oder eine Matrix (n, d).
+    :param whitening: Die Whitening-Matrix (Standard: die des Standard-Feature-Stores).
+    :return: Die geweißten Vektoren in derselben Form.
+    """
+    if whitening is None:
+        whitening = load_whitening_matrix()
+    return np.asarray(vectors, dtype=np.float64) @ whitening.T
+
+def center(vectors):
+    """
+    Zentriert Vektoren zeilenweise und normiert sie auf Länge 1, sodass die Cosinus-Ähnlichkeit
+    der Pearson-Korrelation entspricht. Vektoren ohne Varianz werden zu Nullvektoren.
+
+    :param vectors: Ein Vektor (d,) oder eine Matrix (n, d).
+    :return: Die zentrierten Vektoren in derselben Form.
+    """
+    vectors = np.asarray(vectors, dtype=np.float64)
+    centered = vectors - vectors.mean(axis=-1, keepdims=True)
+    norms = np.linalg.norm(centered, axis=-1, keepdims=True)
+    return np.divide(centered, norms, out=np.zeros_like(centered), where=norms != 0)
+
+# Transformation der Anfragevektoren je durchsuchter Spalte
+COLUMN_TRANSFORMS = {
+    "embedding_whitened": whiten,
+    "embedding_centered": center,
+}
+
+def normalize_metric(metric):
+    """
+    Vereinheitlicht Metriknamen der CLI, z.B. 'inner-product' zu 'inner_product'.
+    """
+    return metric.replace("-", "_")
+
+def prepare_query_vector(metric, input_vector):
+    """
+    Überführt einen Anfragevektor in den Raum der durchsuchten Spalte einer Metrik.
+    """
+    transform = COLUMN_TRANSFORMS.get(get_search_metric(metric)["column"])
+    if transform is not None:
+        return transform(input_vector).tolist()
+    return input_vector
+
+def get_search_metric(metric):
+    """
+    Gibt die Konfiguration einer Metrik zurück.
 
+    :param metric: Name der Metrik ('cosine', 'euclidean', 'inner_product', 'manhattan', 'mahalanobis', 'pearson').
+    :return: Ein Dictionary mit Spalte, pgvector-Operator und Operator-Klasse der Metrik.
+    """
+    if metric not in SEARCH_METRICS:
+        raise ValueError("Ungültige Metrik. Wähle zwischen 'cosine', 'euclidean', 'inner_product', 'manhattan', 'mahalanobis' oder 'pearson'.")
+    return SEARCH_METRICS[metric]
+
+def build_search_query(metric, input_vector, include_identical=True):
+    """
+    Erstellt die SQL-Abfrage für eine Similarity Search. Das Limit wird als Parameter (%s) übergeben.
+
+    :param metric: Die Metrik für die Similarity Search.
     :param input_vector: Der Vektor, nach dem gesucht wird (Liste von Zahlen).
-    :param limit: Die maximale Anzahl von Ergebnissen.
-    :param metric: Die Metrik für die Similarity Search ('cosine', 'euclidean', 'inner_product').
     :param include_identical: Boolean, ob Lieder mit identischen Embeddings berücksichtigt werden sollen.
-    :return: Ein Dictionary mit den Ergebnissen.
+    :return: Die SQL-Abfrage als String.
     """
-    conn = connect_to_db()
-    cursor = conn.cursor()
-
-    # Wähle den passenden Operator basierend auf der Metrik
-    if metric == "cosine":
-        operator = "<=>"
-    elif metric == "euclidean":
-        operator = "<->"
-    elif metric == "inner_product":
-        operator = "<#>"
-    else:
-        raise ValueError("Ungültige Metrik. Wähle zwischen 'cosine', 'euclidean' oder 'inner_product'.")
+    # Wähle die passende Spalte und den Operator basierend auf der Metrik
+    search_metric = get_search_metric(metric)
+    column = search_metric["column"]
+    operator = search_metric["operator"]
 
     # Eingabevektor in ein String-Format umwandeln
-    vector_str = ','.join(map(str, input_vector))
+    vector = vector_to_literal(input_vector)
+    search_vector = vector_to_literal(prepare_query_vector(metric, input_vector))
 
     # SQL-Abfrage für Similarity Search
     query = f"""
     SELECT id, name, label, embedding
     FROM track
-    WHERE embedding {operator} '[{vector_str}]' IS NOT NULL
+    WHERE {column} {operator} '{search_vector}' IS NOT NULL
     """
     
     # Füge Bedingung hinzu, um identische Embeddings zu filtern
     if not include_identical:
-        query += f" AND embedding != '[{vector_str}]'"
-
-    query += f" ORDER BY embedding {operator} '[{vector_str}]' LIMIT %s;"
-
-    # Query ausführen
-    cursor.execute(query, (limit,))
-    results = cursor.fetchall()
+        query += f" AND embedding != '{vector}'"
 
-    cursor.close()
-    conn.close()
+    query += f" ORDER BY {column} {operator} '{search_vector}' LIMIT %s;"
+    return query
 
-    # Ergebnisse in ein Dictionary umwandeln
-    results_dict = [
+def rows_to_dicts(rows):
+    """
+    Wandelt Ergebniszeilen (id, name, label, embedding) in Dictionaries um.
+    """
+    return [
         {
             "id": row[0],
             "name": row[1],
             "label": row[2],
             "embedding": row[3]
         }
-        for row in results
+        for row in rows
     ]
 
-    return results_dict
+class RetrievalMemo:
+    """
+    Merkt sich die Ergebnisse der Similarity Search für die Dauer eines Laufs, sodass jede Anfrage
+    nur einmal an die Datenbank geht. Schlüssel sind der Anfragevektor (auf float32 gerundet wie in
+    pgvector), die Metrik und das Limit. Fragen mehrere Threads gleichzeitig denselben Vektor an,
+    wird nur einmal gesucht und die übrigen warten auf das Ergebnis.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(vector, metric, limit):
+        return np.asarray(vector, dtype=np.float32).tobytes(), metric, limit
+
+    def claim(self, key):
+        """
+        Gibt das Future für den Schlüssel zurück. Liegt noch keines vor, wird es angelegt und der
+        Aufrufer ist für die Suche zuständig: er setzt das Ergebnis mit future.set_result() oder
+        meldet einen Fehler mit fail(). Alle anderen warten mit future.result() auf dieselbe Suche.
+
+        :return: Ein Tupel (Future, ob der Aufrufer die Suche ausführen muss).
+        """
+        with self._lock:
+            future = self._entries.get(key)
+            if future is not None:
+                self.hits += 1
+                return future, False
+            future = Future()
+            self._entries[key] = future
+            self.misses += 1
+            return future, True
+
+    def fail(self, key, future, error):
+        """
+        Meldet eine fehlgeschlagene Suche an die Wartenden. Sie wird nicht gespeichert, damit sie
+        erneut versucht werden kann.
+        """
+        with self._lock:
+            if self._entries.get(key) is future:
+                del self._entries[key]
+        future.set_exception(error)
+
+    def get_or_compute(self, key, compute):
+        """
+        Gibt das Ergebnis für den Schlüssel zurück und berechnet es bei Bedarf mit compute().
+        """
+        future, owner = self.claim(key)
+        if owner:
+            try:
+                future.set_result(compute())
+            except BaseException as e:
+                self.fail(key, future, e)
+        return future.result()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+def retrieval(input_vector, limit=10, metric="cosine", include_identical=True, pool=None):
+    """
+    Führt eine Similarity Search mit einer wählbaren Metrik durch und gibt die Ergebnisse als Dictionary zurück.
+
+    :param input_vector: Der Vektor, nach dem gesucht wird (Liste von Zahlen).
+    :param limit: Die maximale Anzahl von Ergebnissen.
+    :param metric: Die Metrik für die Similarity Search ('cosine', 'euclidean', 'inner_product', 'manhattan', 'mahalanobis', 'pearson').
+    :param include_identical: Boolean, ob Lieder mit identischen Embeddings berücksichtigt werden sollen.
+    :param pool: Optionaler Verbindungspool; ohne Angabe wird der geteilte Pool verwendet.
+    :return: Ein Dictionary mit den Ergebnissen.
+    """
+    query = build_search_query(normalize_metric(metric), input_vector, include_identical)
+
+    # Query über eine Verbindung aus dem Pool ausführen
+    pool = pool if pool is not None else get_pool()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, (limit,))
+        results = cursor.fetchall()
+        cursor.close()
+
+    # Ergebnisse in ein Dictionary umwandeln
+    return rows_to_dicts(results)
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from src.setup.data_to_pgvector import _changed_rows, _vector_fields, content_hash, encode_copy_chunk, whitening_hash
+from src.utils.formatting import VECTOR_COLUMNS
+
+def _chunk():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(4, len(VECTOR_COLUMNS))), columns=VECTOR_COLUMNS)
+    df["ID"] = [f"id{i}" for i in range(4)]
+    df["Name"] = "Track"
+    df["Label"] = "1"
+    return df
+
+def test_encode_copy_chunk_uses_given_whitening_matrix():
+    df = _chunk()
+    embeddings = df[VECTOR_COLUMNS].to_numpy(dtype=np.float64)
+    scaled = 2.0 * np.eye(len(VECTOR_COLUMNS))
+
+    stream = encode_copy_chunk(df, scaled).getvalue()
+    for whitened in _vector_fields(2.0 * embeddings):
+        assert whitened in stream
+
+    identity = encode_copy_chunk(df, np.eye(len(VECTOR_COLUMNS))).getvalue()
+    for field in _vector_fields(embeddings):
+        assert identity.count(field) == 2
+
+def test_incremental_load_stages_only_new_and_changed_rows():
+    df = _chunk()
+    digest = whitening_hash(np.eye(len(VECTOR_COLUMNS)))
+    embeddings = df[VECTOR_COLUMNS].to_numpy(dtype=np.float64)
+    known = {track_id: content_hash(name, label, embedding, digest)
+             for track_id, name, label, embedding in zip(df["ID"], df["Name"], df["Label"], embeddings)}
+
+    assert _changed_rows(df, known, digest).empty
+
+    known["id1"] = "veraltet"
+    known["id2"] = None  # abgeleitete Vektorspalte ist NULL
+    del known["id3"]
+    assert _changed_rows(df, known, digest)["ID"].tolist() == ["id1", "id2", "id3"]
+
+    # Eine neue Kovarianzmatrix ändert die geweißten Embeddings aller Tracks
+    other = whitening_hash(2.0 * np.eye(len(VECTOR_COLUMNS)))
+    assert len(_changed_rows(df, known, other)) == len(df)
@@ -0,0 +1,32 @@
+import random
+
+from src.data.meta_results import MAX_DISTINCT_VALUES, RunningStats, generate_meta_results
+
+def test_binary_metric_quantiles_are_observed_values():
+    stats = RunningStats()
+    for value in [1] * 94 + [0] * 6:
+        stats.add(value)
+    summary = stats.to_dict()
+    assert summary["p50"] in {0, 1}
+    assert summary["p50"] == 1
+    assert abs(summary["mean"] - 0.94) < 1e-9
+
+def test_correctness_p50_from_results():
+    results = [{"label": i % 2, "correctness": int(i % 3 != 0)} for i in range(200)]
+    distribution = generate_meta_results(results)["distributions"]["correctness"]
+    for name in ["p50", "p95", "p99"]:
+        assert distribution[name] in {0, 1}
+
+def test_discrete_scale_uses_nearest_rank():
+    stats = RunningStats()
+    for value in [0.0, 0.0, 0.5, 1.0]:
+        stats.add(value)
+    assert stats.to_dict()["p50"] == 0.0
+    assert stats.to_dict()["p99"] == 1.0
+
+def test_continuous_metric_falls_back_to_p2():
+    rng = random.Random(0)
+    stats = RunningStats()
+    for _ in range(MAX_DISTINCT_VALUES * 5):
+        stats.add(rng.random())
+    assert abs(stats.to_dict()["p50"] - 0.5) < 0.05
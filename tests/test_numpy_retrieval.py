@@ -0,0 +1,23 @@
+import json
+
+import numpy as np
+
+from src.utils.numpy_retrieval import format_float4, format_vector
+
+# Zeile wie sie pgvector für SELECT embedding::text ausgibt
+PGVECTOR_ROW = "[1,0.1,-2.5,1e-05,0.0001,123456,1.234567e+06,-123.456,-0,3.4028235e+38,1e-45,100000,1e+06]"
+VALUES = [1.0, 0.1, -2.5, 1e-05, 0.0001, 123456.0, 1234567.0, -123.456, -0.0, 3.4028235e38, 1e-45, 100000.0, 1e6]
+
+def test_format_vector_matches_pgvector_text_output():
+    embedding = np.asarray(VALUES, dtype=np.float32)
+    assert format_vector(embedding) == PGVECTOR_ROW
+
+def test_format_float4_has_no_trailing_zero():
+    assert format_float4(np.float32(1.0)) == "1"
+    assert format_float4(np.float32(-7.0)) == "-7"
+
+def test_format_vector_round_trips_float32():
+    embedding = np.random.default_rng(0).normal(scale=100.0, size=(50, 13)).astype(np.float32)
+    for row in embedding:
+        parsed = np.asarray(json.loads(format_vector(row)), dtype=np.float32)
+        assert np.array_equal(parsed, row)
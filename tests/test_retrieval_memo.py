@@ -0,0 +1,45 @@
+import threading
+
+import pytest
+
+from src.utils.retrieval import RetrievalMemo
+
+def test_claim_returns_in_flight_future():
+    memo = RetrievalMemo()
+    key = RetrievalMemo.make_key([0.1, 0.2], "cosine", 5)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return ["ergebnis"]
+
+    worker = threading.Thread(target=memo.get_or_compute, args=(key, compute))
+    worker.start()
+    started.wait(5)
+
+    # Die Suche läuft noch: der Batch-Pfad erhält dasselbe Future und sucht nicht erneut
+    future, owner = memo.claim(key)
+    assert not owner
+    assert not future.done()
+
+    release.set()
+    worker.join(5)
+    assert future.result() == ["ergebnis"]
+    assert calls == [1]
+    assert memo.stats() == {"hits": 1, "misses": 1, "entries": 1}
+
+def test_failed_search_is_retried():
+    memo = RetrievalMemo()
+    key = RetrievalMemo.make_key([1.0], "euclidean", 3)
+    future, owner = memo.claim(key)
+    assert owner
+    memo.fail(key, future, RuntimeError("Datenbank nicht erreichbar"))
+    with pytest.raises(RuntimeError):
+        future.result()
+
+    _, owner = memo.claim(key)
+    assert owner